@@ -8,22 +8,46 @@ r"""
 - 見出し「ワンピ買取表」1.2倍 / ロゴとアクション群は中央寄せ
 - 画像ON/OFFどちらの状態でも必ず描画されるrender()に刷新
 - ページャ中央 / カート・ビューア開閉時のスクロールロック＋フォーカス管理（jump防止）
+
+import しても何も実行しない。ビルドは main()（コマンドライン）/ build(excel_path)（各段階を順に呼ぶ）
 """
+from __future__ import annotations
+import time
+_T_START = time.perf_counter()
 
-from typing import Optional, List, Tuple
+from typing import Optional, List, Tuple, Dict
 from pathlib import Path
 from urllib.parse import urlparse, parse_qs
-import pandas as pd
 import html as html_mod
 import unicodedata as ud
-import base64, mimetypes, os, sys, hashlib, io, json, re, glob
+import base64, mimetypes, os, sys, hashlib, io, json, re, glob, pickle, gzip, heapq
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 
 try:
-    import requests
-    from PIL import Image
+    import brotli
 except Exception:
-    requests = None
-    Image = None
+    brotli = None
+
+# 重い依存は使う段階で読み込む（load_pandas / load_imaging）。テンプレートだけの再ビルドで requests / Pillow を読まない
+pd = np = None
+requests = Image = pil_features = None
+
+def load_pandas():
+    global pd, np
+    if pd is None:
+        import numpy as np, pandas as pd
+
+def load_imaging() -> bool:
+    # requests / Pillow（サムネ・ロゴ/アイコンの最適化用）。無ければ False
+    global requests, Image, pil_features
+    if Image is None:
+        try:
+            import requests
+            from PIL import Image, features as pil_features
+        except Exception:
+            requests = Image = pil_features = None
+    return Image is not None
 
 # ====== 入力パス ======
 DEFAULT_EXCEL = r"C:\Users\user\OneDrive\Desktop\ワンピ買取表\buylist.xlsm"
@@ -31,14 +55,10 @@ DEFAULT_EXCEL = r"C:\Users\user\OneDrive\Desktop\ワンピ買取表\buylist.xlsm
 ALT_EXCEL = DEFAULT_EXCEL
 FALLBACK_WINDOWS = DEFAULT_EXCEL
 
-# 環境変数・コマンドライン引数があっても無視して固定
+# 環境変数があっても無視して固定（コマンドライン引数があれば main() がそちらを優先）
 EXCEL_PATH = DEFAULT_EXCEL
 SHEET_NAME = "シート1"
 
-# コマンドライン引数があればさらにそれを優先
-if len(sys.argv) > 1 and sys.argv[1]:
-    EXCEL_PATH = sys.argv[1]
-
 
 # ====== 出力・設定 ======
 OUT_DIR    = Path(os.getenv("OUT_DIR", "docs"))
@@ -55,6 +75,11 @@ X_ICON_FILE_ENV    = os.getenv("X_ICON_FILE", "").strip()
 LINE_ICON_FILE_ENV = os.getenv("LINE_ICON_FILE", "").strip()
 IG_ICON_FILE_ENV   = os.getenv("IG_ICON_FILE", "").strip()
 TT_ICON_FILE_ENV   = os.getenv("TT_ICON_FILE", "").strip()
+# ロゴ/SNSアイコン：asset（assets/img/<hash>.<ext> に1回だけ出力して URL 参照）/ inline（従来の data URI）
+ICON_MODE       = os.getenv("ICON_MODE", "asset").strip().lower()
+ICON_INLINE_MAX = int(os.getenv("ICON_INLINE_MAX", "2048"))   # これ以下のバイト数なら asset モードでもインライン
+ICON_MAX_PX     = int(os.getenv("ICON_MAX_PX", "128"))        # アイコンの最大辺（表示 40px 前後の 2〜3 倍）
+LOGO_MAX_H      = int(os.getenv("LOGO_MAX_H", "240"))         # ロゴの最大高さ（PC表示 110px の 2 倍強）
 
 # よく使う固定ディレクトリ（探索用）
 FIXED_DIRS = [
@@ -68,8 +93,43 @@ FIXED_DIRS = [
 IDX_NAME, IDX_PACK, IDX_CODE, IDX_RARITY, IDX_BOOST, IDX_PRICE, IDX_IMGURL = 2,4,5,6,7,14,16
 # P列 = 16列目 → 0始まりで 15
 IDX_PROMO = 15  # P列（チェック/フラグ）
+# 使う列：ヘッダ名の候補 → 無ければ列位置（get_col と同じ解決順）
+COL_SPECS = {
+    "name":   (["display_name","商品名"],            IDX_NAME),
+    "pack":   (["expansion","エキスパンション"],      IDX_PACK),
+    "code":   (["cardnumber","カード番号"],           IDX_CODE),
+    "rarity": (["rarity","レアリティ"],               IDX_RARITY),
+    "boost":  (["pack_name","封入パック","パック名"],  IDX_BOOST),
+    "price":  (["buy_price","買取価格"],             IDX_PRICE),
+    "imgurl": (["allow_auto_print_label","画像URL"],  IDX_IMGURL),
+    "promo":  (["promo","強化","チェック","check","flag"], IDX_PROMO),
+}
+# カードデータの形：columns（列ごとの配列・辞書化・ビット列）/ rows（従来の [{n,p,c,...}]）
+PAYLOAD_FORMAT = os.getenv("PAYLOAD_FORMAT", "columns").strip().lower()
+# カードデータの置き場所：external（assets/cards.<ver>.json を各ページから fetch）/ inline（従来の埋め込み）
+#   / shards（弾ごとに分けた assets/shard.<ver>.json を、最新弾・強化買取の片から順に読む。目録は cards.<ver>.json）
+CARDS_MODE = os.getenv("CARDS_MODE", "external").strip().lower()
+CARDS_KEEP = max(1, int(os.getenv("CARDS_KEEP", "3")))   # 古い版も何世代か残す（キャッシュ済みページの参照切れ防止）
+SHARD_MIN = max(1, int(os.getenv("SHARD_MIN", "1000")))   # これより少ない弾は隣の弾とまとめて1片に
+# Excel 読込方式：auto（calamine → stream）/ stream（openpyxl read-only で必要列だけ）/ calamine / pandas（従来）
+INGEST_MODE = os.getenv("INGEST_MODE", "auto").strip().lower()
+INGEST_COMPARE = os.getenv("INGEST_COMPARE", "0") == "1"   # 1 なら全方式の時間・ピークメモリを比較表示
 THUMB_DIR = OUT_DIR / "assets" / "thumbs"
-THUMB_W = 600
+# 幅違いのサムネを生成（最大幅が従来どおり <md5>.webp、他は <md5>-<幅>.webp）
+THUMB_WIDTHS = sorted({int(x) for x in os.getenv("THUMB_WIDTHS", "200,300,600").split(",") if x.strip()}) or [600]
+THUMB_W = THUMB_WIDTHS[-1]
+# AVIF 版（<md5>[-<幅>].avif）。auto = Pillow が対応していれば生成
+THUMB_AVIF_ENV = os.getenv("THUMB_AVIF", "auto").strip().lower()
+THUMB_AVIF = False   # BUILD_THUMBS のときだけ Pillow を読み込んで決める（add_thumbs）
+THUMB_SIG = ",".join(map(str, THUMB_WIDTHS))
+# サムネ並列度（取得＝スレッド / 変換＝プロセス）
+THUMB_FETCH_WORKERS  = max(1, int(os.getenv("THUMB_FETCH_WORKERS", "8")))
+THUMB_ENCODE_WORKERS = max(1, int(os.getenv("THUMB_ENCODE_WORKERS", str(os.cpu_count() or 1))))
+THUMB_TIMEOUT = float(os.getenv("THUMB_TIMEOUT", "12"))
+# サムネ台帳（ETag/Last-Modified）。TTL 内は再検証しない / 参照されなくなったサムネは削除
+THUMB_MANIFEST = OUT_DIR / "assets" / "thumbs.manifest.json"
+THUMB_TTL_HOURS = float(os.getenv("THUMB_TTL_HOURS", "24"))
+THUMB_GC = os.getenv("THUMB_GC", "1") == "1"
 
 # ====== 共有ユーティリティ ======
 def _cand_paths(names):
@@ -101,29 +161,83 @@ def file_to_data_uri(p: Optional[Path]) -> str:
     except Exception:
         return ""
 
-LOGO_PATH = find_logo_path()
-X_ICON_PATH = find_icon_path(
-    X_ICON_FILE_ENV,
-    ["X.png","x.png","x-logo.png","assets/X.png"]
-)
-LINE_ICON_PATH = find_icon_path(
-    LINE_ICON_FILE_ENV,
-    ["LINE.png","line.png","line-icon.png","assets/LINE.png"]
-)
-INSTAGRAM_ICON_PATH = find_icon_path(
-    IG_ICON_FILE_ENV,
-    ["IG.png","Instagram.png","instagram.png","insta.png","assets/instagram.png","assets/IG.png"]
-)
-TIKTOK_ICON_PATH = find_icon_path(
-    TT_ICON_FILE_ENV,
-    ["TT.png","TikTok.png","tiktok.png","tiktok-icon.png","assets/tiktok.png","assets/TT.png"]
-)
-
-LOGO_URI = file_to_data_uri(LOGO_PATH)
-X_ICON_URI = file_to_data_uri(X_ICON_PATH)
-LINE_ICON_URI = file_to_data_uri(LINE_ICON_PATH)
-INSTAGRAM_ICON_URI = file_to_data_uri(INSTAGRAM_ICON_PATH)
-TIKTOK_ICON_URI = file_to_data_uri(TIKTOK_ICON_PATH)
+SITE_ASSETS = {}        # 出力時に書き出すファイル（OUT_DIR からの相対パス → bytes）
+IMAGE_SAVINGS = [0]     # data URI をやめて減った 1ページあたりのバイト数
+
+def _optimize_image(raw: bytes, ext: str, box: Tuple[int, int]) -> Tuple[bytes, str]:
+    # 縮小 → WebP（ロスレス）と最適化 PNG を作り、元データも含めて一番小さいものを採用
+    # 結果は CACHE_DIR/img に元画像のハッシュ + 枠で覚える（同じ画像なら次回は Pillow を読み込まない）
+    cached = CACHE_DIR / "img" / f"{hashlib.sha256(raw).hexdigest()[:16]}-{box[0]}x{box[1]}"
+    hit = next(cached.parent.glob(cached.name + ".*"), None) if INPUT_CACHE and cached.parent.is_dir() else None
+    if hit: return hit.read_bytes(), hit.suffix.lstrip(".")
+    cands = [(raw, ext)]
+    if load_imaging():
+        try:
+            im = Image.open(io.BytesIO(raw)); im.load()
+            im = im.convert("RGBA") if im.mode in ("P", "LA", "RGBA") or "transparency" in im.info else im.convert("RGB")
+            im.thumbnail(box, Image.LANCZOS)
+            for fmt, ext, kw in [("WEBP", "webp", {"lossless": True, "method": 6}), ("PNG", "png", {"optimize": True})]:
+                b = io.BytesIO(); im.save(b, fmt, **kw); cands.append((b.getvalue(), ext))
+        except Exception:
+            pass
+    data, ext = min(cands, key=lambda c: len(c[0]))
+    if INPUT_CACHE and len(cands) > 1:
+        cached.parent.mkdir(parents=True, exist_ok=True)
+        tmp = cached.with_name(f".{cached.name}.{os.getpid()}.tmp")
+        tmp.write_bytes(data); os.replace(tmp, cached.with_name(f"{cached.name}.{ext}"))
+    return data, ext
+
+def image_uri(p: Optional[Path], box: Tuple[int, int]) -> str:
+    # ページ（OUT_DIR/<mode>/index.html）から見た画像 URL。小さいもの・SVG 以外で最適化できないものは元の扱い
+    if not p: return ""
+    inline = file_to_data_uri(p)
+    if ICON_MODE != "asset" or not inline: return inline
+    try:
+        raw = p.read_bytes()
+    except Exception:
+        return inline
+    ext = p.suffix.lower().lstrip(".") or "png"
+    data, ext = (raw, ext) if ext == "svg" else _optimize_image(raw, ext, box)
+    if len(data) <= ICON_INLINE_MAX:
+        mime = "image/svg+xml" if ext == "svg" else f"image/{ext}"
+        uri = f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+    else:
+        rel = f"assets/img/{hashlib.sha256(data).hexdigest()[:16]}.{ext}"
+        SITE_ASSETS[rel] = data
+        uri = "../" + rel
+    IMAGE_SAVINGS[0] += len(inline) - len(uri)
+    return uri
+
+LOGO_PATH = X_ICON_PATH = LINE_ICON_PATH = INSTAGRAM_ICON_PATH = TIKTOK_ICON_PATH = None
+LOGO_URI = X_ICON_URI = LINE_ICON_URI = INSTAGRAM_ICON_URI = TIKTOK_ICON_URI = ""
+
+def load_icons():
+    # ロゴ・SNS アイコンを探して URI に（外部化したものは SITE_ASSETS へ）
+    global LOGO_PATH, X_ICON_PATH, LINE_ICON_PATH, INSTAGRAM_ICON_PATH, TIKTOK_ICON_PATH
+    global LOGO_URI, X_ICON_URI, LINE_ICON_URI, INSTAGRAM_ICON_URI, TIKTOK_ICON_URI
+    SITE_ASSETS.clear(); IMAGE_SAVINGS[0] = 0
+    LOGO_PATH = find_logo_path()
+    X_ICON_PATH = find_icon_path(
+        X_ICON_FILE_ENV,
+        ["X.png","x.png","x-logo.png","assets/X.png"]
+    )
+    LINE_ICON_PATH = find_icon_path(
+        LINE_ICON_FILE_ENV,
+        ["LINE.png","line.png","line-icon.png","assets/LINE.png"]
+    )
+    INSTAGRAM_ICON_PATH = find_icon_path(
+        IG_ICON_FILE_ENV,
+        ["IG.png","Instagram.png","instagram.png","insta.png","assets/instagram.png","assets/IG.png"]
+    )
+    TIKTOK_ICON_PATH = find_icon_path(
+        TT_ICON_FILE_ENV,
+        ["TT.png","TikTok.png","tiktok.png","tiktok-icon.png","assets/tiktok.png","assets/TT.png"]
+    )
+    LOGO_URI = image_uri(LOGO_PATH, (LOGO_MAX_H * 5, LOGO_MAX_H))
+    X_ICON_URI = image_uri(X_ICON_PATH, (ICON_MAX_PX, ICON_MAX_PX))
+    LINE_ICON_URI = image_uri(LINE_ICON_PATH, (ICON_MAX_PX, ICON_MAX_PX))
+    INSTAGRAM_ICON_URI = image_uri(INSTAGRAM_ICON_PATH, (ICON_MAX_PX, ICON_MAX_PX))
+    TIKTOK_ICON_URI = image_uri(TIKTOK_ICON_PATH, (ICON_MAX_PX, ICON_MAX_PX))
 
 # ====== 入力 ======
 def _read_csv_auto(path: Path) -> pd.DataFrame:
@@ -153,7 +267,8 @@ def _resolve_input(pref: Optional[str]) -> Path:
         try:
             if p.exists() and p.is_file(): return p
         except Exception: pass
-    files = sorted([Path(p) for p in glob.glob("*.csv")]+[Path(p) for p in glob.glob("*.xlsm")],
+    # ~$buylist.xlsm は Excel が開いている間のロックファイル（中身はブックではない）
+    files = sorted([Path(p) for p in glob.glob("*.csv") + glob.glob("*.xlsm") if not Path(p).name.startswith("~$")],
                    key=lambda x: x.stat().st_mtime, reverse=True)
     if files: return files[0]
     raise FileNotFoundError("CSV/Excel が見つかりません。")
@@ -173,25 +288,116 @@ def load_buylist_any(path_hint: str, sheet_name: Optional[str]) -> pd.DataFrame:
         df0=pd.read_excel(xls, sheet_name=xls.sheet_names[0], header=None, engine="openpyxl")
     return _normalize_two_header_layout(df0)
 
-df_raw = load_buylist_any(EXCEL_PATH, SHEET_NAME)
+# pandas の read_excel が欠損扱いにする文字列 / Excel のエラー値
+PANDAS_NA_STR = {"", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+                 "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"}
+XL_ERRORS = {"#NULL!", "#DIV/0!", "#VALUE!", "#REF!", "#NAME?", "#NUM!", "#N/A"}
+
+def _xl_value(v):
+    # read_excel(engine="openpyxl") と同じ値に揃える（整数値の float → int、欠損文字列 → None）
+    if isinstance(v, float) and v.is_integer(): return int(v)
+    if isinstance(v, str) and (v in PANDAS_NA_STR or v in XL_ERRORS): return None
+    return v
+
+def _pick_sheet(names: List[str], sheet_name: Optional[str]) -> str:
+    # 完全一致 → NFKC 一致（「シート1」と「シート１」）→ 先頭シート
+    if sheet_name in names: return sheet_name
+    key = ud.normalize("NFKC", sheet_name or "")
+    return next((n for n in names if ud.normalize("NFKC", n) == key), names[0])
+
+def _iter_rows_openpyxl(p: Path, sheet_name: Optional[str]):
+    from openpyxl import load_workbook
+    wb = load_workbook(p, read_only=True, data_only=True, keep_links=False)
+    try:
+        yield from wb[_pick_sheet(wb.sheetnames, sheet_name)].iter_rows(values_only=True)
+    finally:
+        wb.close()
+
+def _iter_rows_calamine(p: Path, sheet_name: Optional[str]):
+    from python_calamine import CalamineWorkbook
+    wb = CalamineWorkbook.from_path(str(p))
+    yield from wb.get_sheet_by_name(_pick_sheet(wb.sheet_names, sheet_name)).iter_rows()
+
+def _project_rows(rows) -> pd.DataFrame:
+    # 先頭12行から2段ヘッダ（display_name / cardnumber）を探し、COL_SPECS の列だけを取り出す
+    rows = iter(rows)
+    head = [r for _, r in zip(range(12), rows)]
+    hdr = next((i for i, r in enumerate(head) if "display_name" in r and "cardnumber" in r), None)
+    header = list(head[hdr]) if hdr is not None else []
+    idx = {}
+    for key, (names, fb) in COL_SPECS.items():
+        idx[key] = next((header.index(nm) for nm in names if nm in header), fb)
+    cols = {key: [] for key in COL_SPECS}
+    pick = list(idx.items())
+    start = hdr + 2 if hdr is not None else 0
+    def take(r):
+        n = len(r)
+        for key, i in pick:
+            cols[key].append(_xl_value(r[i]) if i < n else None)
+    for r in head[start:]: take(r)
+    for r in rows: take(r)
+    # 末尾の空行は read_excel と同様に落とす
+    n = len(cols["name"])
+    while n and all(cols[k][n-1] is None for k in cols): n -= 1
+    return pd.DataFrame({COL_SPECS[k][0][0]: pd.Series(v[:n], dtype=object) for k, v in cols.items()})
+
+def load_buylist_fast(path_hint: str, sheet_name: Optional[str], mode: str) -> pd.DataFrame:
+    p = _resolve_input(path_hint)
+    if p.suffix.lower() == ".csv" or mode == "pandas":
+        return load_buylist_any(path_hint, sheet_name)
+    reader = _iter_rows_calamine if mode == "calamine" else _iter_rows_openpyxl
+    return _project_rows(reader(p, sheet_name))
+
+def _has_calamine() -> bool:
+    try:
+        import python_calamine  # noqa: F401
+        return True
+    except Exception:
+        return False
+
+def _measure(fn):
+    import tracemalloc
+    tracemalloc.start(); t0 = time.perf_counter()
+    try: out = fn()
+    finally:
+        sec = time.perf_counter() - t0; peak = tracemalloc.get_traced_memory()[1]; tracemalloc.stop()
+    return out, sec, peak
+
+def load_buylist(path_hint: str, sheet_name: Optional[str]) -> pd.DataFrame:
+    mode = INGEST_MODE
+    if mode == "auto": mode = "calamine" if _has_calamine() else "stream"
+    if INGEST_COMPARE:
+        for m in ["pandas", "stream"] + (["calamine"] if _has_calamine() else []):
+            d, sec, peak = _measure(lambda: load_buylist_fast(path_hint, sheet_name, m))
+            print(f"[INGEST] compare {m:8s} {sec*1000:8.0f}ms  peak {peak/1e6:7.1f}MB  {d.shape[0]}行×{d.shape[1]}列")
+    t0 = time.perf_counter()
+    d = load_buylist_fast(path_hint, sheet_name, mode)
+    print(f"[INGEST] {mode} {(time.perf_counter() - t0) * 1000:.0f}ms {d.shape[0]}行×{d.shape[1]}列")
+    return d
+
 from datetime import datetime
 
-try:
-    # 実際に使われる入力ファイルのパスを解決して更新時刻を取得
-    INPUT_FILE = _resolve_input(EXCEL_PATH)
-    UPDATED_AT = datetime.fromtimestamp(INPUT_FILE.stat().st_mtime).strftime("%Y/%m/%d %H:%M")
-    UPDATED_LABEL = f"最終更新：{UPDATED_AT}"
-except Exception:
-    UPDATED_LABEL = ""
+UPDATED_LABEL = ""
+
+def updated_label(path_hint: str) -> str:
+    try:
+        # 実際に使われる入力ファイルのパスを解決して更新時刻を取得
+        updated_at = datetime.fromtimestamp(_resolve_input(path_hint).stat().st_mtime).strftime("%Y/%m/%d %H:%M")
+        return f"最終更新：{updated_at}"
+    except Exception:
+        return ""
 
 # ====== テキスト整形 ======
 SEP_RE = re.compile(r"[\s\u30FB\u00B7·/／\-_—–−]+")
 
+NULL_WORDS = {"nan","NaN","None","NONE","null","NULL","nil","NIL"}
+
 def clean_text(s: pd.Series) -> pd.Series:
+    # 完全一致の NULL 表記 / 前後空白つきの nan（大小無視）を空に。正規表現を使わず isin とマスクで判定
     s=s.astype(str)
-    s=s.str.replace(r'(?i)^\s*nan\s*$', '', regex=True)
-    s=s.replace({"nan":"","NaN":"","None":"","NONE":"","null":"","NULL":"","nil":"","NIL":""})
-    return s.fillna("").str.strip()
+    t=s.str.strip()
+    null=s.isin(NULL_WORDS) | t.str.lower().eq("nan")
+    return t.mask(null, "").fillna("")
 
 def to_int_series(s: pd.Series) -> pd.Series:
     if pd.api.types.is_numeric_dtype(s):
@@ -199,46 +405,61 @@ def to_int_series(s: pd.Series) -> pd.Series:
     s=s.astype(str).str.replace(r"[^\d\.\-,]", "", regex=True).str.replace(",", "", regex=False)
     return pd.to_numeric(s, errors="coerce").round().astype("Int64")
 
-def to_bool_series(s: pd.Series) -> pd.Series:
-    TRUE_SET  = {"true","1","yes","y","on","☑","✓","✔","◯","○","レ","済"}
-    FALSE_SET = {"false","0","no","n","off","","none","nan","null"}
-
-    def _one(v):
-        # ネイティブ bool / 数値はそのまま判定
-        if isinstance(v, bool):
-            return v
-        if isinstance(v, (int, float)):
-            try:
-                return float(v) > 0
-            except Exception:
-                return False
+TRUE_SET  = {"true","1","yes","y","on","☑","✓","✔","◯","○","レ","済"}
+FALSE_SET = {"false","0","no","n","off","","none","nan","null"}
 
-        # 文字列は正規化して判定
-        t = str(v).strip().lower()
-        if t in TRUE_SET:
-            return True
-        if t in FALSE_SET:
+def to_bool_py(v) -> bool:
+    # 参照実装（1要素ずつ）。to_bool_series と同じ判定
+    # ネイティブ bool / 数値はそのまま判定
+    if isinstance(v, bool):
+        return v
+    if isinstance(v, (int, float)):
+        try:
+            return float(v) > 0
+        except Exception:
             return False
 
-        # Excel の TRUE/FALSE（大文字）など
-        if t == "true":
-            return True
-        if t == "false":
-            return False
+    # 文字列は正規化して判定
+    t = str(v).strip().lower()
+    if t in TRUE_SET:
+        return True
+    if t in FALSE_SET:
+        return False
 
-        # それ以外は安全側で False
+    # Excel の TRUE/FALSE（大文字）など
+    if t == "true":
+        return True
+    if t == "false":
         return False
 
-    return s.map(_one)
+    # それ以外は安全側で False
+    return False
+
+def to_bool_series(s: pd.Series) -> pd.Series:
+    # 列単位で判定：文字列は TRUE_SET 照合、ネイティブ bool / 数値は > 0
+    if pd.api.types.is_bool_dtype(s):
+        return s.fillna(False).astype(bool)
+    if pd.api.types.is_numeric_dtype(s):
+        return pd.to_numeric(s, errors="coerce").gt(0)
+    is_str = s.map(type).eq(str)
+    by_text = s.astype(str).str.strip().str.lower().isin(TRUE_SET)
+    by_num  = pd.to_numeric(s.where(~is_str), errors="coerce").gt(0)
+    return (is_str & by_text) | (~is_str & by_num)
+
+IMG_FORMULA_RE = re.compile(r'@?IMAGE\s*\(\s*["\']\s*(https?://[^"\']+)\s*["\']', re.IGNORECASE)
+IMG_QUOTED_RE  = re.compile(r'^[=]?\s*["\']\s*(https?://[^"\']+)\s*["\']\s*$')
+IMG_URL_RE     = re.compile(r'(https?://[^\s"\')]+)')
+IMG_FULLWIDTH  = str.maketrans({"＠": "@", "＂": '"', "＇": "'"})
 
 def detail_to_img(val: str) -> str:
+    # 参照実装（1要素ずつ）。通常は detail_to_img_series を使う
     if not isinstance(val,str): return ""
-    s=val.strip().replace("＠","@").replace("＂",'"').replace("＇","'")
-    m=re.search(r'@?IMAGE\s*\(\s*["\']\s*(https?://[^"\']+)\s*["\']', s, flags=re.IGNORECASE)
+    s=val.strip().translate(IMG_FULLWIDTH)
+    m=IMG_FORMULA_RE.search(s)
     if m: return m.group(1).strip()
-    m=re.search(r'^[=]?\s*["\']\s*(https?://[^"\']+)\s*["\']\s*$', s)
+    m=IMG_QUOTED_RE.search(s)
     if m: return m.group(1).strip()
-    m=re.search(r'(https?://[^\s"\')]+)', s)
+    m=IMG_URL_RE.search(s)
     if m: return m.group(1).strip()
     if s.lower().startswith(("http://","https://")): return s
     parsed=urlparse(s)
@@ -250,21 +471,117 @@ def detail_to_img(val: str) -> str:
     if slug: return f"https://dm.takaratomy.co.jp/wp-content/card/cardimage/{slug}.jpg"
     return ""
 
+def detail_to_img_series(s: pd.Series) -> pd.Series:
+    # URL だけの行はそのまま採用。それ以外は列単位の正規表現で抽出し、
+    # URL を含まない残り（id= / slug 形式）だけ参照実装に回す
+    t = s.astype(str).str.strip()
+    if any(ch in "".join(t.tolist()) for ch in "＠＂＇"): t = t.str.translate(IMG_FULLWIDTH)
+    url = pd.Series(np.where(t.str.fullmatch(IMG_URL_RE).fillna(False), t, None), index=t.index, dtype=object)
+    other = url.isna() & t.ne("")
+    if other.any():
+        o = t[other]
+        url[other] = (o.str.extract(IMG_FORMULA_RE, expand=False)
+                       .fillna(o.str.extract(IMG_QUOTED_RE, expand=False))
+                       .fillna(o.str.extract(IMG_URL_RE, expand=False))
+                       .str.strip())
+        rest = url.isna() & t.ne("")
+        if rest.any():
+            url[rest] = t[rest].map(detail_to_img)
+    return url.fillna("").astype(str)
+
 def nfkc_lower(s:str)->str: return ud.normalize("NFKC", s or "").lower()
 
+# カタカナ（ァ〜ン）→ ひらがな の変換表
+KATA_TO_HIRA = {c: c - 0x60 for c in range(ord("ァ"), ord("ン") + 1)}
+
 def kata_to_hira(text:str)->str:
-    return "".join(chr(ord(ch)-0x60) if "ァ"<=ch<="ン" else ch for ch in text)
+    return text.translate(KATA_TO_HIRA)
 
 def normalize_for_search_py(text: str) -> str:
+    # 参照実装（1文字列ずつ）。列単位は normalize_for_search_series
     s = ud.normalize("NFKC", str(text or "")).lower()
     s = kata_to_hira(s)
     s = SEP_RE.sub("", s)
     return s
 
+# SEP_RE が消す文字（\s 相当の空白 + 記号類）のコードポイント表（初回に作る）
+_SEP_CODEPOINTS = None
+def sep_codepoints():
+    global _SEP_CODEPOINTS
+    if _SEP_CODEPOINTS is None:
+        _SEP_CODEPOINTS = np.array(sorted({c for c in range(0x3001) if chr(c).isspace()}
+                                          | {ord(ch) for ch in "\u30FB\u00B7·/／-_—–−"}), dtype=np.uint32)
+    return _SEP_CODEPOINTS
+
+_NFKC_TABLES = None
+def nfkc_tables():
+    # BMP 各文字の NFKC 1文字写像表と「文脈依存」フラグ。
+    # 写像が1文字・結合クラス0・合成の2文字目になり得ない文字は1文字ずつ置換しても NFKC と同じ結果になる
+    global _NFKC_TABLES
+    if _NFKC_TABLES is None:
+        cmap = np.arange(0x10000, dtype=np.uint32)
+        cx = np.zeros(0x10000, dtype=bool)
+        cx[0xD800:0xE000] = True
+        seconds = set(range(0x1161, 0x1176)) | set(range(0x11A8, 0x11C3))   # ハングル V/T
+        for c in range(0x10000):
+            d = ud.decomposition(chr(c))
+            if d and not d.startswith("<") and len(d.split()) == 2:
+                seconds.add(int(d.split()[1], 16))
+        for c in range(0x10000):
+            if cx[c]: continue
+            m = ud.normalize("NFKC", chr(c))
+            if len(m) != 1 or ud.combining(m) or ud.combining(chr(c)) or ord(m) in seconds or c in seconds:
+                cx[c] = True
+            else:
+                cmap[c] = ord(m)
+        _NFKC_TABLES = (cmap, cx)
+    return _NFKC_TABLES
+
+def _nfkc_many(vals: List[str]) -> List[str]:
+    # 文字列リストをまとめて NFKC。表で置換できない文字を含む文字列だけ unicodedata.normalize に回す
+    cmap, cx = nfkc_tables()
+    cp = np.frombuffer("\0".join(vals).encode("utf-32-le"), dtype=np.uint32)
+    low = np.minimum(cp, 0xFFFF)
+    hard = cx[low] | (cp > 0xFFFF)
+    out = np.where(cp > 0xFFFF, cp, cmap[low]).astype(np.uint32).tobytes().decode("utf-32-le").split("\0")
+    if hard.any():
+        sid = np.cumsum(cp == 0)
+        for i in np.unique(sid[hard]).tolist():
+            out[i] = ud.normalize("NFKC", vals[i])
+    return out
+
+def normalize_for_search_series(s: pd.Series) -> pd.Series:
+    # 列全体を \0 区切りでまとめて NFKC / lower を実行し、
+    # カタカナ→ひらがな と区切り文字の除去は UTF-32 の数値配列上で行う（normalize_for_search_py と同じ結果）
+    vals = s.astype(str).tolist()
+    try:
+        if sum(v.count("\0") for v in vals): raise ValueError("NUL in text")
+        blob = "\0".join(_nfkc_many(vals)).lower()
+        cp = np.frombuffer(blob.encode("utf-32-le"), dtype=np.uint32).copy()
+    except (ValueError, UnicodeError):
+        return s.astype(str).map(normalize_for_search_py)
+    cp[(cp >= 0x30A1) & (cp <= 0x30F3)] -= 0x60
+    cp = cp[~np.isin(cp, sep_codepoints())]
+    return pd.Series(cp.tobytes().decode("utf-32-le").split("\0"), index=s.index, dtype=object)
+
 def searchable_row_py(row: pd.Series) -> str:
+    # 参照実装（行ごと）。列単位は searchable_series
     parts=[row.get(k,"") for k in ("name","code","pack","rarity","booster")]
     return normalize_for_search_py(" ".join(map(str, parts)))
 
+def searchable_series(df: pd.DataFrame) -> pd.Series:
+    # 連結用の空白は区切り文字として消えるので、列ごとに（重複を除いた値だけ）正規化してから連結すれば同じ結果
+    parts = []
+    for k in ("name","code","pack","rarity","booster"):
+        if k not in df.columns: continue
+        codes, uniq = pd.factorize(df[k].astype(str), use_na_sentinel=False)
+        normed = normalize_for_search_series(pd.Series(uniq, dtype=object)).to_numpy(dtype=object)
+        parts.append(normed[codes])
+    if not parts: return pd.Series("", index=df.index, dtype=object)
+    out = parts[0]
+    for p in parts[1:]: out = out + p
+    return pd.Series(out, index=df.index, dtype=object)
+
 def get_col(df: pd.DataFrame, names: List[str], fallback_idx: Optional[int]):
     for nm in names:
         if nm in df.columns: return df[nm]
@@ -272,73 +589,359 @@ def get_col(df: pd.DataFrame, names: List[str], fallback_idx: Optional[int]):
         return df.iloc[:, fallback_idx]
     return pd.Series([""]*len(df), index=df.index)
 
-S_NAME   = get_col(df_raw, ["display_name","商品名"],            IDX_NAME)
-S_PACK   = get_col(df_raw, ["expansion","エキスパンション"],      IDX_PACK)
-S_CODE   = get_col(df_raw, ["cardnumber","カード番号"],           IDX_CODE)
-S_RARITY = get_col(df_raw, ["rarity","レアリティ"],               IDX_RARITY)
-S_BOOST  = get_col(df_raw, ["pack_name","封入パック","パック名"],  IDX_BOOST)
-S_PRICE  = get_col(df_raw, ["buy_price","買取価格"],             IDX_PRICE)
-S_IMGURL = get_col(df_raw, ["allow_auto_print_label","画像URL"],  IDX_IMGURL)
-S_PROMO  = get_col(df_raw, ["promo","強化","チェック","check","flag"], IDX_PROMO)
-
-PACK_CLEAN = clean_text(S_PACK)
-
-df = pd.DataFrame({
-    "promo":   to_bool_series(S_PROMO),
-    "name":    clean_text(S_NAME),
-    "pack":    PACK_CLEAN,  # ← ここ、今は clean_text(S_PACK) になってるので PACK_CLEAN を使うと安全
-    "code":    clean_text(S_CODE),
-    "rarity":  clean_text(S_RARITY),
-    "booster": clean_text(S_BOOST),
-    "price":   to_int_series(S_PRICE) if len(S_PRICE) else pd.Series([None]*len(df_raw)),
-    "image":   clean_text(S_IMGURL).map(detail_to_img),
-})
-df = df[~df["name"].str.match(r"^Unnamed", na=False)]
-df = df[df["name"].str.strip()!=""].reset_index(drop=True)
-df["s"] = df.apply(searchable_row_py, axis=1)
-df["latest"] = PACK_CLEAN.str.strip().str.upper().eq("M2A")
+def build_df(path_hint: str) -> pd.DataFrame:
+    df_raw = load_buylist(path_hint, SHEET_NAME)
+    S_NAME   = get_col(df_raw, *COL_SPECS["name"])
+    S_PACK   = get_col(df_raw, *COL_SPECS["pack"])
+    S_CODE   = get_col(df_raw, *COL_SPECS["code"])
+    S_RARITY = get_col(df_raw, *COL_SPECS["rarity"])
+    S_BOOST  = get_col(df_raw, *COL_SPECS["boost"])
+    S_PRICE  = get_col(df_raw, *COL_SPECS["price"])
+    S_IMGURL = get_col(df_raw, *COL_SPECS["imgurl"])
+    S_PROMO  = get_col(df_raw, *COL_SPECS["promo"])
+
+    _t_norm = time.perf_counter()
+    PACK_CLEAN = clean_text(S_PACK)
+
+    df = pd.DataFrame({
+        "promo":   to_bool_series(S_PROMO),
+        "name":    clean_text(S_NAME),
+        "pack":    PACK_CLEAN,  # ← ここ、今は clean_text(S_PACK) になってるので PACK_CLEAN を使うと安全
+        "code":    clean_text(S_CODE),
+        "rarity":  clean_text(S_RARITY),
+        "booster": clean_text(S_BOOST),
+        "price":   to_int_series(S_PRICE) if len(S_PRICE) else pd.Series([None]*len(df_raw)),
+        "image":   detail_to_img_series(clean_text(S_IMGURL)),
+    })
+    df = df[~df["name"].str.match(r"^Unnamed", na=False)]
+    df = df[df["name"].str.strip()!=""].reset_index(drop=True)
+    df["s"] = searchable_series(df)
+    df["latest"] = PACK_CLEAN.str.strip().str.upper().eq("M2A")
+    print(f"[NORM] {len(df)}件 正規化 {(time.perf_counter() - _t_norm) * 1000:.0f}ms")
+    return df
+
+# ====== 正規化済み入力キャッシュ ======
+# 入力ファイルの中身のハッシュ + 正規化コードのハッシュが同じなら、読込・正規化を丸ごと飛ばす
+# （テンプレートや LIFF_ID だけ変えた再ビルド用）
+CACHE_DIR   = Path(os.getenv("CACHE_DIR", ".cache"))
+INPUT_CACHE = os.getenv("INPUT_CACHE", "1") == "1"
+INPUT_CACHE_FILE = CACHE_DIR / "input.pkl"
+NORM_VERSION = "1"   # 正規化ロジックの外（設定など）で出力が変わる修正をしたら上げる
+
+def norm_code_digest() -> str:
+    # 「入力」〜「サムネ生成」直前までのソースをハッシュに含める（正規化コードを触ると自動で無効化）
+    h = hashlib.sha256(f"{NORM_VERSION}|{SHEET_NAME}|{COL_SPECS!r}".encode("utf-8"))
+    try:
+        src = Path(__file__).read_text(encoding="utf-8")
+        a = src.index("# ====== 入力 ======"); b = src.index("# ====== サムネ生成", a)
+        h.update(src[a:b].encode("utf-8"))
+    except Exception:
+        pass
+    return h.hexdigest()
+
+def input_cache_key(p: Path) -> str:
+    h = hashlib.sha256()
+    with open(p, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""): h.update(chunk)
+    return f"{h.hexdigest()}:{norm_code_digest()}"
+
+def load_input_cache(key: str) -> Optional[pd.DataFrame]:
+    try:
+        with open(INPUT_CACHE_FILE, "rb") as f: obj = pickle.load(f)
+        if obj.get("key") == key: return obj["df"]
+    except Exception:
+        pass
+    return None
+
+def save_input_cache(key: str, df: pd.DataFrame):
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = INPUT_CACHE_FILE.with_suffix(".pkl.tmp")
+    with open(tmp, "wb") as f: pickle.dump({"key": key, "df": df}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, INPUT_CACHE_FILE)
+
+def load_df(path_hint: str) -> pd.DataFrame:
+    # 入力 → 正規化済み df（キャッシュがあれば読込・正規化を飛ばす）
+    load_pandas()
+    t0 = time.perf_counter()
+    key = input_cache_key(_resolve_input(path_hint)) if INPUT_CACHE else ""
+    df = load_input_cache(key) if INPUT_CACHE else None
+    if df is not None:
+        print(f"[CACHE] hit {INPUT_CACHE_FILE} {len(df)}件 {(time.perf_counter() - t0) * 1000:.0f}ms")
+        return df
+    if INPUT_CACHE: print(f"[CACHE] miss {INPUT_CACHE_FILE}")
+    df = build_df(path_hint)
+    if INPUT_CACHE: save_input_cache(key, df)
+    return df
 
 
 # ====== サムネ生成（任意） ======
 def url_to_hash(u:str)->str: return hashlib.md5(u.encode("utf-8")).hexdigest()
-def ensure_thumb(url: str) -> Optional[str]:
-    if not url: return None
-    THUMB_DIR.mkdir(parents=True, exist_ok=True)
-    fname = url_to_hash(url) + ".webp"; outp = THUMB_DIR / fname
-    if outp.exists(): return f"assets/thumbs/{fname}"
-    if not (requests and Image): return None
+def thumb_name(url: str) -> str: return url_to_hash(url) + ".webp"
+
+_HTTP = None
+def http_session():
+    # keep-alive を使い回す共有セッション（取得スレッド数ぶんの接続プール）
+    global _HTTP
+    if _HTTP is None and requests:
+        from requests.adapters import HTTPAdapter
+        s = requests.Session()
+        s.headers["User-Agent"] = "Mozilla/5.0"
+        ad = HTTPAdapter(pool_connections=THUMB_FETCH_WORKERS, pool_maxsize=THUMB_FETCH_WORKERS)
+        s.mount("http://", ad); s.mount("https://", ad)
+        _HTTP = s
+    return _HTTP
+
+def fetch_image(url: str, entry: Optional[dict] = None):
+    # entry に ETag/Last-Modified があれば条件付き GET。戻り値 (status, bytes, headers, 秒)
+    t0 = time.perf_counter()
+    hdrs = {}
+    if entry and entry.get("etag"):          hdrs["If-None-Match"] = entry["etag"]
+    if entry and entry.get("last_modified"): hdrs["If-Modified-Since"] = entry["last_modified"]
+    r = http_session().get(url, timeout=THUMB_TIMEOUT, headers=hdrs)
+    if r.status_code == 304:
+        return 304, b"", r.headers, time.perf_counter() - t0
+    r.raise_for_status()
+    return r.status_code, r.content, r.headers, time.perf_counter() - t0
+
+def thumb_variant_names(url: str) -> List[str]:
+    stem = url_to_hash(url)
+    names = []
+    for w in THUMB_WIDTHS:
+        suf = "" if w == THUMB_W else f"-{w}"
+        names.append(f"{stem}{suf}.webp")
+        if THUMB_AVIF: names.append(f"{stem}{suf}.avif")
+    return names
+
+def _save_atomic_image(im, path: str, fmt: str, **kw):
+    tmp = path + ".tmp"
+    im.save(tmp, fmt, **kw)
+    os.replace(tmp, path)
+
+def encode_thumb(data: bytes, out_path: str):
+    # 変換プロセス側で実行（リサイズ＋WEBP/AVIF保存）。out_path は最大幅の <md5>.webp
+    # 小さい幅は最大幅の縮小結果からさらに縮小する。戻り値 (最大幅の出力サイズ or None, 秒)
+    t0 = time.perf_counter()
+    im = Image.open(io.BytesIO(data)).convert("RGB")
+    w,h = im.size
+    if w<=0 or h<=0: return None, time.perf_counter() - t0
+    new_h = max(1, int(h * THUMB_W / w))
+    base = im.resize((THUMB_W, new_h), Image.LANCZOS)
+    stem = out_path[:-len(".webp")]
+    for tw in reversed(THUMB_WIDTHS):
+        sub = base if tw == THUMB_W else base.resize((tw, max(1, int(new_h * tw / THUMB_W))), Image.LANCZOS)
+        suf = "" if tw == THUMB_W else f"-{tw}"
+        _save_atomic_image(sub, f"{stem}{suf}.webp", "WEBP", quality=60, method=6)
+        if THUMB_AVIF:
+            _save_atomic_image(sub, f"{stem}{suf}.avif", "AVIF", quality=45)
+    return (THUMB_W, new_h), time.perf_counter() - t0
+
+def load_thumb_manifest() -> dict:
     try:
-        r=requests.get(url, timeout=12, headers={"User-Agent":"Mozilla/5.0"}); r.raise_for_status()
-        im=Image.open(io.BytesIO(r.content)).convert("RGB")
-        w,h=im.size
-        if w<=0 or h<=0: return None
-        new_h=int(h * THUMB_W / w)
-        im=im.resize((THUMB_W, max(1,new_h)), Image.LANCZOS)
-        outp.parent.mkdir(parents=True, exist_ok=True)
-        im.save(outp, "WEBP", quality=60, method=6)
-        return f"assets/thumbs/{fname}"
+        m = json.loads(THUMB_MANIFEST.read_text(encoding="utf-8"))
+        return m if isinstance(m, dict) else {}
     except Exception:
-        return None
+        return {}
+
+def save_thumb_manifest(m: dict):
+    THUMB_MANIFEST.parent.mkdir(parents=True, exist_ok=True)
+    tmp = THUMB_MANIFEST.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(m, ensure_ascii=False, indent=1, sort_keys=True), encoding="utf-8")
+    os.replace(tmp, THUMB_MANIFEST)
+
+def gc_thumbs(manifest: dict, keep_urls) -> int:
+    # df から参照されなくなったサムネ（全幅・全形式）と台帳エントリを削除（<md5>[-<幅>].webp/.avif のみ対象）
+    keep = set(keep_urls)
+    if not keep: return 0
+    for u in [u for u in manifest if u not in keep]: del manifest[u]
+    keep_files = {n for u in keep for n in thumb_variant_names(u)}
+    removed = 0
+    for f in THUMB_DIR.iterdir():
+        if re.fullmatch(r"[0-9a-f]{32}(-\d+)?\.(webp|avif)", f.name) and f.name not in keep_files:
+            try: f.unlink(); removed += 1
+            except OSError: pass
+    return removed
+
+def _encode_pool():
+    # fork が使える環境だけプロセスプール。spawn の子は import し直しになり、add_thumbs で決めた THUMB_AVIF 等を引き継げないためスレッドで代用
+    # （Pillow の resize / WEBP 保存は GIL を離すのでスレッドでもある程度並列に効く）
+    if THUMB_ENCODE_WORKERS > 1 and "fork" in mp.get_all_start_methods():
+        pool = ProcessPoolExecutor(THUMB_ENCODE_WORKERS, mp_context=mp.get_context("fork"))
+        pool.submit(int).result()  # 取得スレッドが動き出す前にワーカーを fork しておく
+        return pool, "process"
+    return ThreadPoolExecutor(THUMB_ENCODE_WORKERS), "thread"
+
+def build_thumbs(urls) -> Tuple[dict, set]:
+    # URL → "assets/thumbs/<md5>.webp"。取得はスレッド、変換はプロセスで流し込み、同時処理数は上限付き
+    # 台帳の ETag/Last-Modified で条件付き GET し、200 のときだけ再変換（304 は既存サムネを継続利用）
+    # 幅/形式の構成（THUMB_SIG）が台帳と違うサムネは条件なしで取り直す。
+    # 戻り値の2つ目は幅違い一式が揃っている URL の集合
+    urls = list(dict.fromkeys(u for u in urls if u))
+    manifest = load_thumb_manifest()
+    now = int(time.time()); ttl = THUMB_TTL_HOURS * 3600
+    out = {}; todo = []
+    for u in urls:
+        e = manifest.get(u)
+        if (THUMB_DIR / thumb_name(u)).exists():
+            out[u] = f"assets/thumbs/{thumb_name(u)}"
+            if e and e.get("v") == THUMB_SIG and now - e.get("checked", 0) < ttl: continue
+            if not e: manifest[u] = {"file": thumb_name(u), "checked": 0}  # 台帳導入前のサムネ → 今回取り直す
+        todo.append(u)
+    st = {"fresh": len(out) - sum(1 for u in todo if u in out), "not_modified": 0, "updated": 0,
+          "fetch_fail": 0, "encode_fail": 0, "fetch_s": 0.0, "encode_s": 0.0, "bytes": 0}
+    if todo and not (requests and Image):
+        print(f"[THUMB] requests / Pillow が無いため {len(todo)} 件スキップ")
+        return out, set()
+    t0 = time.perf_counter(); kind = "-"
+    if todo:
+        THUMB_DIR.mkdir(parents=True, exist_ok=True)
+        enc_pool, kind = _encode_pool()
+        max_inflight = THUMB_FETCH_WORKERS + THUMB_ENCODE_WORKERS * 2
+        it = iter(todo); dl = {}; enc = {}
+        with enc_pool, ThreadPoolExecutor(THUMB_FETCH_WORKERS) as fetch_pool:
+            while True:
+                while len(dl) + len(enc) < max_inflight:
+                    u = next(it, None)
+                    if u is None: break
+                    entry = manifest.get(u) if u in out and manifest[u].get("v") == THUMB_SIG else None
+                    dl[fetch_pool.submit(fetch_image, u, entry)] = u
+                if not dl and not enc: break
+                done, _ = wait(list(dl) + list(enc), return_when=FIRST_COMPLETED)
+                for f in done:
+                    if f in dl:
+                        u = dl.pop(f)
+                        try: status, data, hdrs, sec = f.result()
+                        except Exception: st["fetch_fail"] += 1; continue
+                        st["fetch_s"] += sec
+                        if status == 304:
+                            manifest[u]["checked"] = now; st["not_modified"] += 1; continue
+                        st["bytes"] += len(data)
+                        manifest[u] = {"file": thumb_name(u), "etag": hdrs.get("ETag", ""),
+                                       "last_modified": hdrs.get("Last-Modified", ""),
+                                       "bytes": len(data), "checked": 0, "v": ""}
+                        enc[enc_pool.submit(encode_thumb, data, str(THUMB_DIR / thumb_name(u)))] = u
+                    else:
+                        u = enc.pop(f)
+                        try: size, sec = f.result()
+                        except Exception: size, sec = None, 0.0
+                        st["encode_s"] += sec
+                        if size:
+                            out[u] = f"assets/thumbs/{thumb_name(u)}"
+                            manifest[u].update(w=size[0], h=size[1], checked=now, v=THUMB_SIG); st["updated"] += 1
+                        else:
+                            st["encode_fail"] += 1
+    removed = gc_thumbs(manifest, urls) if THUMB_GC else 0
+    save_thumb_manifest(manifest)
+    wall = time.perf_counter() - t0
+    print(f"[THUMB] 対象{len(urls)}件: 生成/更新{st['updated']} / 未変更(304){st['not_modified']} / TTL内{st['fresh']}"
+          f" / 取得失敗{st['fetch_fail']} / 変換失敗{st['encode_fail']} / 削除{removed}")
+    full = {u for u in out if manifest.get(u, {}).get("v") == THUMB_SIG}
+    if todo:
+        print(f"[THUMB] fetch計{st['fetch_s']:.1f}s ({st['bytes']/1e6:.1f}MB, {THUMB_FETCH_WORKERS}並列)"
+              f" / encode計{st['encode_s']:.1f}s ({THUMB_ENCODE_WORKERS}並列:{kind}) / wall {wall:.1f}s")
+    print(f"[THUMB] 幅 {THUMB_SIG} 一式: {len(full)}/{len(out)}件")
+    return out, full
+
+def add_thumbs(df: pd.DataFrame):
+    global THUMB_AVIF, THUMB_SIG
+    if not BUILD_THUMBS:
+        df["thumb"] = ""
+        df["tv"]    = False
+        return
+    load_imaging()
+    THUMB_AVIF = THUMB_AVIF_ENV != "0" and bool(pil_features and pil_features.check("avif"))
+    THUMB_SIG = ",".join(map(str, THUMB_WIDTHS)) + ("+avif" if THUMB_AVIF else "")
+    thumbs, full = build_thumbs(df["image"])
+    df["thumb"] = df["image"].map(thumbs.get)
+    df["tv"]    = df["image"].isin(full)
+
+# ====== 検索キー（ブラウザと同じ正規化） ======
+# base_js が読み込み時に作っていた _name / _name_lat / ... の8本をビルド時に作ってペイロードに載せる。
+# ブラウザ側の normalizeForSearch / normalizeLatin と1文字も違わないこと（PARITY_CHECK=1 で node と突き合わせ）
+PARITY_CHECK = os.getenv("PARITY_CHECK", "0") == "1"
+
+# JS の \s（String.prototype.replace の空白）+ base_js の SEP_RE の記号
+JS_SEP_RE = re.compile(r"[\t\n\v\f\r \u00a0\u1680\u2000-\u200a\u2028\u2029\u202f\u205f\u3000\ufeff\u30FB\u00B7·/／\-_—–−]+")
+JS_KATA_TO_HIRA = {c: c - 0x60 for c in range(0x30A1, 0x30FB)}   # kataToHira: [\u30A1-\u30FA]
+LATIN_LEET = str.maketrans("013457", "oleast")
+LATIN_DROP_RE = re.compile(r"[^a-z0-9]")
+
+def js_normalize_for_search(text: str) -> str:
+    # base_js の normalizeForSearch（NFKC → 小文字 → カナ→かな → 区切り除去）
+    return JS_SEP_RE.sub("", ud.normalize("NFKC", text or "").lower().translate(JS_KATA_TO_HIRA))
+
+def js_normalize_latin(text: str) -> str:
+    # base_js の normalizeLatin（NFKC → 小文字 → 0/1/3/4/5/7 の読み替え → 英数字以外を除去）
+    return LATIN_DROP_RE.sub("", ud.normalize("NFKC", text or "").lower().translate(LATIN_LEET))
+
+# JS 側のキー名 → (" " で連結する列, 正規化)。並びはペイロードの "q" 配列の並び
+SEARCH_KEYS = [
+    ("_name",            ["name"],            js_normalize_for_search),
+    ("_name_lat",        ["name"],            js_normalize_latin),
+    ("_code",            ["code"],            js_normalize_for_search),
+    ("_code_lat",        ["code"],            js_normalize_latin),
+    ("_packbooster",     ["pack", "booster"], js_normalize_for_search),
+    ("_packbooster_lat", ["pack", "booster"], js_normalize_latin),
+    ("_rarity",          ["rarity"],          js_normalize_for_search),
+    ("_rarity_lat",      ["rarity"],          js_normalize_latin),
+]
 
-if BUILD_THUMBS: df["thumb"] = df["image"].map(ensure_thumb)
-else:            df["thumb"] = ""
+def search_key_sources(df: pd.DataFrame, cols: List[str]) -> pd.Series:
+    text = df[cols[0]].fillna("").astype(str)
+    for c in cols[1:]: text = text + " " + df[c].fillna("").astype(str)
+    return text
+
+def add_search_keys(df: pd.DataFrame):
+    # 同じ値（弾名・レアリティなど）は一度だけ正規化
+    t0 = time.perf_counter()
+    for key, cols, fn in SEARCH_KEYS:
+        src = search_key_sources(df, cols)
+        uniq = pd.unique(src)
+        df[key] = src.map(dict(zip(uniq, map(fn, uniq)))).astype(object)
+    print(f"[KEYS] 検索キー{len(SEARCH_KEYS)}本 {(time.perf_counter() - t0) * 1000:.0f}ms")
+
+PARITY_SAMPLES = ["ｱｲｳｴｵ ｶﾞｷﾞ", "ヴァヷヸヹヺ", "ㇰㇱ", "Ⅻ ①㍻", "ﬁﬂ", "İstanbul", "Straße", "ΟΔΟΣ", "\ufeffA\x1cB\x85C",
+                  "ＯＰ０１－００１", "モンキー・Ｄ・ルフィ", "0134 57-SEC", "a/b／c_d—e–f−g·h", "🃏カード", "ポケモンカード", "ex EX ｅｘ"]
+
+def search_key_parity_mismatches(js_source: str, vals: List[str]) -> Optional[list]:
+    # base_js から正規化関数を切り出して node で実行し、Python 側の結果と違う値を [(値, js, py), ...] で返す。node が無ければ None
+    import shutil, subprocess
+    node = shutil.which("node")
+    if not node: return None
+    a = js_source.index("const SEP_RE"); b = js_source.index("function rarityKeyFromPair")
+    script = (js_source[a:b] + "\nconst vals=JSON.parse(require('fs').readFileSync(0,'utf8'));"
+              "process.stdout.write(JSON.stringify(vals.map(v=>[normalizeForSearch(v),normalizeLatin(v)])));")
+    out = subprocess.run([node, "-e", script], input=json.dumps(vals).encode("utf-8"), capture_output=True, check=True)
+    got = json.loads(out.stdout.decode("utf-8"))
+    return [(v, g, [js_normalize_for_search(v), js_normalize_latin(v)]) for v, g in zip(vals, got)
+            if g != [js_normalize_for_search(v), js_normalize_latin(v)]]
+
+def check_search_key_parity(js_source: str, df: pd.DataFrame) -> bool:
+    # 入力の全値 + PARITY_SAMPLES で Python 側と完全一致か確かめる（tests/test_search_keys.py は固定の値で同じことをする）
+    vals = sorted({v for _, cols, _ in SEARCH_KEYS for v in search_key_sources(df, cols)} | set(PARITY_SAMPLES))
+    bad = search_key_parity_mismatches(js_source, vals)
+    if bad is None:
+        print("[PARITY] node が見つからないためスキップ"); return True
+    print(f"[PARITY] 検索キー {len(vals)}値 不一致{len(bad)}")
+    for v, g, py in bad[:10]: print(f"  {v!r}: js={g} py={py}")
+    return not bad
 
 # ====== ペイロード ======
-def build_payload(df: pd.DataFrame) -> Tuple[str, str]:
+def build_payload(df: pd.DataFrame) -> Tuple[str, str, list, Dict[str, str]]:
     # 欠損カラムの補完（priceはNone, promoはFalse, 他は空文字）
-    for c in ["name","pack","code","rarity","booster","price","image","thumb","s","promo","latest"]:
+    for c in ["name","pack","code","rarity","booster","price","image","thumb","s","promo","latest","tv"]:
         if c not in df.columns:
             if c == "price":
                 df[c] = None
             elif c == "promo":
                 df[c] = False
-            elif c == "latest":
+            elif c in ("latest", "tv"):
                 df[c] = False
             else:
                 df[c] = ""
 
     records = []
-    for rec in df[["name","pack","code","rarity","booster","price","image","thumb","s","promo","latest"]].to_dict(orient="records"):
+    for rec in df[["name","pack","code","rarity","booster","price","image","thumb","s","promo","latest","tv"]
+                  + [key for key, _, _ in SEARCH_KEYS]].to_dict(orient="records"):
         # 価格の正規化
         price = rec.get("price", None)
         try:
@@ -368,7 +971,7 @@ def build_payload(df: pd.DataFrame) -> Tuple[str, str]:
             t2 = str(latest_raw).strip().lower()
             latest = t2 in {"true","1","yes","y","on"}
 
-        records.append({
+        row = {
             "n": rec.get("name",""),
             "p": rec.get("pack",""),
             "c": rec.get("code",""),
@@ -380,14 +983,387 @@ def build_payload(df: pd.DataFrame) -> Tuple[str, str]:
             "s": rec.get("s",""),
             "k": 1 if promo else 0,       # 強化
             "L": 1 if latest else 0,      # 最新弾（E列M2a）
-        })
+            "q": [rec[key] for key, _, _ in SEARCH_KEYS],   # 検索キー（_name, _name_lat, ...）
+        }
+        if rec.get("tv"): row["v"] = 1   # 幅違いサムネ一式あり（srcset用、無いときは省略）
+        records.append(row)
 
-    payload = json.dumps(records, ensure_ascii=False, separators=(",",":"))
+    shards = {}
+    if CARDS_MODE == "shards":
+        payload, shards = build_shards(records)
+    else:
+        payload = json.dumps(encode_records(records), ensure_ascii=False, separators=(",",":"))
     ver = hashlib.md5(payload.encode("utf-8")).hexdigest()[:8]
-    return ver, payload
+    # 3つ目は id 順の (カード名, 型番, 価格)。価格変動・価格履歴が使う。4つ目は CARDS_MODE=shards の片（版 → JSON）
+    return ver, payload, [(r["n"], r["c"], r["pr"]) for r in records], shards
+
+def encode_records(records: List[dict]):
+    return payload_columns(records) if PAYLOAD_FORMAT == "columns" else records
+
+def build_shards(records: List[dict]) -> Tuple[str, Dict[str, str]]:
+    # 先頭の片＝最新弾・強化買取と、価格の高い順・低い順それぞれ先頭 PER_PAGE 件（どのページも最初の1画面が揃う）。
+    # 残りは弾（正規化）ごとに1片、SHARD_MIN 件に満たない弾は弾名順に隣とまとめる。片の中は id 順
+    # 片 = {"id":[先頭id, 差分, ...], "d":ペイロード}、目録 = {"fmt":"shards","n":件数,"s":[{v,n,lo,hi,p}, ...]}
+    #   lo / hi は片の価格の範囲、p は片に含まれる [弾, 封入パック]（弾の検索で読む片を選ぶ。先頭の片は必ず読むので空）
+    t0 = time.perf_counter()
+    price = [r["pr"] or 0 for r in records]
+    ids = range(len(records))
+    head = (set(heapq.nsmallest(PER_PAGE, ids, key=lambda i: (-price[i], i)))
+            | set(heapq.nsmallest(PER_PAGE, ids, key=lambda i: (price[i], i)))
+            | {i for i, r in enumerate(records) if r["k"] or r["L"]})
+    packs = {}
+    for i, r in enumerate(records):
+        if i not in head: packs.setdefault(js_normalize_for_search(r["p"] or ""), []).append(i)
+    groups, small = [sorted(head)], []
+    for k in sorted(packs):
+        if len(packs[k]) >= SHARD_MIN:
+            groups.append(packs[k]); continue
+        small += packs[k]
+        if len(small) >= SHARD_MIN:
+            groups.append(sorted(small)); small = []
+    if small: groups.append(sorted(small))
+
+    s = lambda v: "" if v is None else str(v)
+    shards, entries = {}, []
+    for j, g in enumerate(groups):
+        if not g: continue
+        recs = [records[i] for i in g]
+        body = json.dumps({"id": [g[0]] + [b - a for a, b in zip(g, g[1:])], "d": encode_records(recs)},
+                          ensure_ascii=False, separators=(",",":"))
+        v = hashlib.md5(body.encode("utf-8")).hexdigest()[:8]
+        shards[v] = body
+        pr = [r["pr"] for r in recs if r["pr"] is not None]
+        entries.append({"v": v, "n": len(g), "lo": min(pr, default=None), "hi": max(pr, default=None),
+                        "p": sorted({(s(r["p"]), s(r["b"])) for r in recs}) if j else []})
+    manifest = json.dumps({"fmt": "shards", "n": len(records), "s": entries}, ensure_ascii=False, separators=(",",":"))
+    kb = lambda x: f"{len(x.encode('utf-8'))/1024:.1f}KB"
+    print(f"[SHARD] {len(entries)}片（先頭 {len(groups[0])}件）目録 {kb(manifest)}"
+          f" / 片 {sum(len(b.encode('utf-8')) for b in shards.values())/1024:.1f}KB {(time.perf_counter() - t0) * 1000:.0f}ms")
+    return manifest, shards
+
+def _dict_encode(vals: List[str]) -> Tuple[List[str], List[int]]:
+    table, codes, pos = [], [], {}
+    for v in vals:
+        j = pos.get(v)
+        if j is None:
+            j = pos[v] = len(table); table.append(v)
+        codes.append(j)
+    return table, codes
+
+def _str_column(vals: List[str], force_dict: bool = False):
+    # 種類が件数の半分以下なら {"t":表,"i":番号}（辞書化）、それ以外は文字列配列のまま
+    vals = ["" if v is None else str(v) for v in vals]
+    table, codes = _dict_encode(vals)
+    return {"t": table, "i": codes} if force_dict or len(table) * 2 <= len(vals) else vals
+
+def _bitset_b64(bits: List[bool]) -> str:
+    b = bytearray((len(bits) + 7) // 8)
+    for i, x in enumerate(bits):
+        if x: b[i >> 3] |= 1 << (i & 7)
+    return base64.b64encode(bytes(b)).decode("ascii")
+
+def payload_columns(records: List[dict]) -> dict:
+    # 行形式 → 列形式（struct-of-arrays）。弾・封入パック・レアリティは辞書化、フラグはビット列（base64）
+    col = lambda k: [r.get(k) for r in records]
+    rarity = _str_column(col("r"), force_dict=True)
+    q = {}
+    for j, (key, _, _) in enumerate(SEARCH_KEYS):
+        vals = [r["q"][j] for r in records]
+        if key in ("_rarity", "_rarity_lat"):
+            # レアリティ由来のキーはレアリティ表と同じ番号列を共有
+            first = {}
+            for code, v in zip(rarity["i"], vals): first.setdefault(code, v)
+            q[key] = {"t": [first[c] for c in range(len(rarity["t"]))], "of": "rarity"}
+        else:
+            q[key] = _str_column(vals)
+    return {
+        "fmt": "cols", "n": len(records),
+        "name": _str_column(col("n")), "code": _str_column(col("c")),
+        "pack": _str_column(col("p"), force_dict=True), "booster": _str_column(col("b"), force_dict=True),
+        "rarity": rarity,
+        "price": col("pr"),
+        "image": _str_column(col("i")), "thumb": _str_column(col("t")),
+        "flags": {"k": _bitset_b64([r["k"] == 1 for r in records]),
+                  "L": _bitset_b64([r["L"] == 1 for r in records]),
+                  "v": _bitset_b64([r.get("v") == 1 for r in records])},
+        "q": q,
+        "order": price_orders(col("pr")),
+    }
 
+def price_orders(prices: List[Optional[int]]) -> dict:
+    # 価格の降順・昇順の並び（id の順列）。価格なしは 0 扱い、同額は id 昇順＝ブラウザの従来の並びと同じ
+    p = [v or 0 for v in prices]
+    ids = range(len(p))
+    return {"desc": sorted(ids, key=lambda i: (-p[i], i)),
+            "asc": sorted(ids, key=lambda i: (p[i], i))}
+
+CARDS_VER = CARDS_JSON = ""
+CARDS_ROWS = []
+CARDS_SHARDS = {}
+
+def data_asset(kind: str, ver: str, ext: str = "json") -> str:
+    return f"assets/{kind}.{ver}.{ext}"
+
+# ====== 検索索引（n-gram 転置索引） ======
+# apply() の部分一致を、bigram の postings の積集合で候補に絞ってから includes で確かめる。
+# 索引のキーはブラウザ側 normalizeForSearch / normalizeLatin と同じ結果でなければならない
+SEARCH_INDEX = os.getenv("SEARCH_INDEX", "1") == "1"
+# 仮想スクロール（ページャなしで全件を縦に続けて見せる）にするページ：カンマ区切りのページ名（default,price_desc,price_asc）か all
+VIRTUAL_SCROLL = {x.strip() for x in os.getenv("VIRTUAL_SCROLL", "").lower().split(",") if x.strip()}
+# 検索を Web Worker で動かすか：0（使わない）/ 1（常に）/ auto（コア数4以下・スマホだけ）
+SEARCH_WORKER = os.getenv("SEARCH_WORKER", "0").strip().lower()
+SEARCH_GRAM = 2   # 3-gram は索引が約2倍になる割に、候補確認（includes）の削減はわずか
+
+# 索引名 → 検索キー列（JS 側 candidateIds の field 名）
+SEARCH_FIELDS = {"name": "_name", "name_lat": "_name_lat", "code": "_code", "code_lat": "_code_lat",
+                 "pack": "_packbooster", "pack_lat": "_packbooster_lat"}
+
+def build_search_index(df: pd.DataFrame) -> Tuple[str, str]:
+    # {"n":2,"c":件数,"f":{索引名:{gram:[先頭id, 差分, 差分, ...]}},"x":詳細検索の値ごとの id 列}。id はペイロードの並び順
+    t0 = time.perf_counter()
+    n = SEARCH_GRAM
+    fields = {}
+    for key, col in SEARCH_FIELDS.items():
+        post = {}
+        for doc, v in enumerate(df[col]):
+            # n 文字未満の値はそのままキーに（n 文字未満の検索語を「含むキーの和集合」で引くため）
+            grams = {v[i:i + n] for i in range(len(v) - n + 1)} if len(v) >= n else ({v} if v else ())
+            for g in grams:
+                post.setdefault(g, []).append(doc)
+        fields[key] = {g: [ids[0]] + [b - a for a, b in zip(ids, ids[1:])] for g, ids in sorted(post.items())}
+    idx = {"n": n, "c": len(df), "f": fields}
+    if FACETS: idx["x"] = facet_postings(df)
+    idx = json.dumps(idx, ensure_ascii=False, separators=(",", ":"))
+    ver = hashlib.md5(idx.encode("utf-8")).hexdigest()[:8]
+    grams = sum(len(f) for f in fields.values())
+    print(f"[INDEX] {n}-gram {grams}語 {len(idx.encode('utf-8'))/1024:.1f}KB {(time.perf_counter() - t0) * 1000:.0f}ms")
+    return ver, idx
+
+SEARCH_VER = SEARCH_JSON = ""
+
+# ====== 詳細検索（価格帯・レアリティ・弾） ======
+# 選べる値と件数はビルド時に df から作ってページに埋め込む。絞り込み自体はブラウザ側で
+# 値ごとの id 列の和・積と、価格順の順列の二分探索で行う。id 列は検索索引の "x" に載せる
+# （索引が使えないとき＝届く前・分割ペイロードの読み込み途中などは、ブラウザが初回に1回の走査で作る）
+FACETS = os.getenv("FACETS", "1") == "1"
+FACET_MAX = int(os.getenv("FACET_MAX", "200"))   # 1項目に並べる値の上限（件数の多い順）
+
+def rarity_facet_key(v: str) -> str:
+    # base_js の rarityKeyFromPair(normalizeForSearch(v), normalizeLatin(v))（promo 系は1つにまとめる）
+    k, l = js_normalize_for_search(v), js_normalize_latin(v)
+    return "promo" if l in ("promo", "p") or k == "ぷろも" else (l or k)
+
+def pack_facet_label(pack: str, booster: str) -> str:
+    # 画像OFF表示の meta と同じ「弾 / 封入パック」
+    return f"{pack} / {booster}" if pack and booster else (pack or booster)
+
+def _facet_col(df: pd.DataFrame, c: str) -> List[str]:
+    return ["" if v is None else str(v) for v in df[c]] if c in df.columns else [""] * len(df)
+
+def build_facets(df: pd.DataFrame) -> dict:
+    # {"rarity":[[値, 表示名, 件数], ...], "pack":[...]}（件数の多い順）。値はブラウザ側の絞り込みキー、空の値は出さない
+    s = lambda c: _facet_col(df, c)
+    rarity = pd.Series(s("rarity"))
+    groups = {}
+    for v, n in rarity[rarity != ""].value_counts(sort=True).items():   # 同じキーの中で一番多い表記を表示名に
+        k = rarity_facet_key(v)
+        if not k: continue
+        g = groups.setdefault(k, [k, v, 0]); g[2] += int(n)
+    packs = pd.Series([pack_facet_label(a, b) for a, b in zip(s("pack"), s("booster"))])
+    packs = packs[packs != ""].value_counts(sort=True)
+    top = lambda rows: sorted(rows, key=lambda g: (-g[2], g[1]))[:FACET_MAX]
+    facets = {"rarity": top(groups.values()), "pack": top([v, v, int(n)] for v, n in packs.items())}
+    print(f"[FACET] レアリティ{len(groups)}種 / 弾{len(packs)}種")
+    return facets
+
+def facet_postings(df: pd.DataFrame) -> dict:
+    # {"rarity":{値:[先頭id, 差分, ...]}, "pack":{...}}。値は build_facets と同じキー（FACET_MAX で切らず全部）
+    rarity = _facet_col(df, "rarity")
+    rk = {v: rarity_facet_key(v) for v in set(rarity)}   # レアリティの表記ごとに1回
+    keys = {"rarity": [rk[v] for v in rarity],
+            "pack": [pack_facet_label(a, b) for a, b in zip(_facet_col(df, "pack"), _facet_col(df, "booster"))]}
+    out = {}
+    for field, col in keys.items():
+        post = {}
+        for doc, k in enumerate(col):
+            if k: post.setdefault(k, []).append(doc)
+        out[field] = {k: [ids[0]] + [b - a for a, b in zip(ids, ids[1:])] for k, ids in sorted(post.items())}
+    return out
+
+FACET_VALUES = {}
+
+def build_data(df: pd.DataFrame):
+    # 検索キー → ペイロード / 検索索引 / 詳細検索の値（html_page・write_site が使う）
+    global CARDS_VER, CARDS_JSON, CARDS_ROWS, CARDS_SHARDS, SEARCH_VER, SEARCH_JSON, FACET_VALUES
+    add_search_keys(df)
+    CARDS_VER, CARDS_JSON, CARDS_ROWS, CARDS_SHARDS = build_payload(df)
+    SEARCH_VER, SEARCH_JSON = build_search_index(df) if SEARCH_INDEX else ("", "")
+    FACET_VALUES = build_facets(df) if FACETS else {}
+
+# ====== 価格変動（前回ビルドとの差分） ======
+# 今出ているページ（OUT_DIR/default/index.html）が参照しているペイロードを「前回」として
+# (カード名, 型番) で突き合わせ、追加・削除・値上がり・値下がり・価格が付いた／外れたカードを changes.<版>.json に出す。
+# ページは「価格変動」ボタンを押したときに読み込む。データが前回と同じ版なら前回の差分を出し続ける
+CHANGES = os.getenv("CHANGES", "1") == "1"
+CHANGES_VER = CHANGES_JSON = ""
+CHANGES_COUNT = 0
+
+def payload_rows(data) -> List[Tuple[str, str, Optional[int]]]:
+    # ペイロード（列形式 / 行形式 / 分割の目録）→ id 順の (カード名, 型番, 価格)
+    if isinstance(data, dict) and data.get("fmt") == "shards":
+        # 目録に載っている片を OUT_DIR から読み、各行を id の位置へ
+        rows = [None] * data["n"]
+        for e in data["s"]:
+            part = json.loads((OUT_DIR / data_asset("shard", e["v"])).read_text(encoding="utf-8"))
+            i = 0
+            for d, row in zip(part["id"], payload_rows(part["d"])):
+                i += d; rows[i] = row
+        return rows
+    if isinstance(data, dict) and data.get("fmt") == "cols":
+        col = lambda c: c if isinstance(c, list) else [c["t"][i] for i in c["i"]]
+        return list(zip(col(data["name"]), col(data["code"]), data["price"]))
+    # 行形式は短いキー。それより前のページ（今 docs に出ている版など）は name / code / price
+    return [(r.get("n", r.get("name", "")), r.get("c", r.get("code", "")), r.get("pr", r.get("price")))
+            for r in data or []]
+
+def previous_build() -> Tuple[str, str, Optional[list]]:
+    # 今出ているページの (ペイロードの版, 価格変動の版, ペイロードの行)。見つからない部分は "" / None
+    try:
+        html = (OUT_DIR / "default" / "index.html").read_text(encoding="utf-8")
+    except OSError:
+        return "", "", None
+    m = re.search(r"<meta name='cards-ver' content='([0-9a-f]*)'>", html)
+    c = re.search(r"<meta name='changes-ver' content='([0-9a-f]*)'>", html)
+    ver, chg = (m.group(1) if m else ""), (c.group(1) if c else "")
+    try:
+        f = OUT_DIR / data_asset("cards", ver)
+        if f.exists():
+            return ver, chg, payload_rows(json.loads(f.read_text(encoding="utf-8")))
+        head = "<script>window.__CARDS__="   # CARDS_MODE=inline のページ
+        i = html.find(head)
+        if i >= 0:
+            return ver, chg, payload_rows(json.JSONDecoder().raw_decode(html, i + len(head))[0])
+    except (OSError, ValueError):
+        pass
+    return ver, chg, None
+
+def card_keys(rows: list):
+    # (カード名, 型番, 価格) → ((カード名, 型番, 同じ組の何件目か), 価格)。同名・同型番が複数あっても一意
+    nth = {}
+    for name, code, price in rows:
+        j = nth.get((name, code), 0); nth[(name, code)] = j + 1
+        yield (name, code, j), price
+
+def diff_rows(prev: list, cur: list) -> dict:
+    # card_keys をキーにしたハッシュ結合（前回 + 今回の件数に比例）
+    # added / up / down は今回のペイロードの id（up / down は [id, 前回の価格]）、removed は前回の行
+    # priced は価格が付いた・外れたカード [id, 前回の価格]（どちらかが null）
+    old = dict(card_keys(prev))
+    added, up, down, priced = [], [], [], []
+    for i, (k, price) in enumerate(card_keys(cur)):
+        if k not in old:
+            added.append(i); continue
+        was = old.pop(k)
+        if price is not None and was is not None:
+            if price != was: (up if price > was else down).append([i, was])
+        elif (price is None) != (was is None):
+            priced.append([i, was])
+    return {"added": added, "up": up, "down": down, "priced": priced,
+            "removed": [[k[0], k[1], p] for k, p in old.items()]}
+
+def build_changes():
+    global CHANGES_VER, CHANGES_JSON, CHANGES_COUNT
+    if not CHANGES: return
+    t0 = time.perf_counter()
+    prev_ver, prev_chg, prev = previous_build()
+    if prev_ver == CARDS_VER:
+        # 同じデータの再ビルド：出ている差分をそのまま使う（無ければ出さない）
+        try:
+            CHANGES_JSON = (OUT_DIR / data_asset("changes", prev_chg)).read_text(encoding="utf-8") if prev_chg else ""
+        except OSError:
+            CHANGES_JSON = ""
+        CHANGES_VER = prev_chg if CHANGES_JSON else ""
+    elif prev is None:
+        print("[DIFF] 前回のペイロードが見つからないため価格変動なし")
+        CHANGES_VER = CHANGES_JSON = ""
+    else:
+        d = diff_rows(prev, CARDS_ROWS)
+        CHANGES_JSON = json.dumps({"from": prev_ver, "to": CARDS_VER, **d}, ensure_ascii=False, separators=(",", ":"))
+        CHANGES_VER = hashlib.md5(CHANGES_JSON.encode("utf-8")).hexdigest()[:8]
+        print(f"[DIFF] {prev_ver} → {CARDS_VER}: 追加{len(d['added'])} / 削除{len(d['removed'])}"
+              f" / 値上がり{len(d['up'])} / 値下がり{len(d['down'])} / 価格の有無{len(d['priced'])} {(time.perf_counter() - t0) * 1000:.0f}ms")
+    if CHANGES_JSON:
+        d = json.loads(CHANGES_JSON)
+        CHANGES_COUNT = len(d["added"]) + len(d["up"]) + len(d["down"]) + len(d.get("priced", []))
+    else:
+        CHANGES_COUNT = 0
+
+# ====== 価格履歴（SQLite） ======
+# ビルドごとに、前回から価格が変わったカード（新規・掲載終了を含む）だけを prices に追記する。
+# cards に各カードの最新価格を持つので、重複判定は cards の1回の読み出しで済み、履歴本体は読まない。
+# 1枚分の推移は prices の主キー (card, ts) の索引を引くだけ（--history <カード名・型番の一部> で表示）
+HISTORY = os.getenv("HISTORY", "1") == "1"
+HISTORY_DB = Path(os.getenv("HISTORY_DB", "price_history.sqlite3"))
+HISTORY_POINTS = int(os.getenv("HISTORY_POINTS", "30"))   # --history で出す直近の点数
+
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS builds(ts INTEGER PRIMARY KEY, ver TEXT NOT NULL, n INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS cards(id INTEGER PRIMARY KEY, name TEXT NOT NULL, code TEXT NOT NULL, nth INTEGER NOT NULL,
+                                 price INTEGER, listed INTEGER NOT NULL DEFAULT 1, UNIQUE(name, code, nth));
+CREATE TABLE IF NOT EXISTS prices(card INTEGER NOT NULL, ts INTEGER NOT NULL, price INTEGER,
+                                  PRIMARY KEY(card, ts)) WITHOUT ROWID;
+"""
 
-CARDS_VER, CARDS_JSON = build_payload(df)
+def open_history():
+    import sqlite3
+    con = sqlite3.connect(HISTORY_DB)
+    con.executescript(HISTORY_SCHEMA)
+    return con
+
+def record_history():
+    # CARDS_ROWS を履歴に追記（prices の price が NULL の点は掲載終了）。前回と同じ版なら何もしない
+    if not HISTORY or not CARDS_VER: return
+    from contextlib import closing
+    t0 = time.perf_counter()
+    with closing(open_history()) as con, con:
+        last = con.execute("SELECT ts, ver FROM builds ORDER BY ts DESC LIMIT 1").fetchone()
+        if last and last[1] == CARDS_VER:
+            print(f"[HIST] 前回と同じ版 {CARDS_VER} のため追記なし"); return
+        ts = max(int(time.time()), last[0] + 1 if last else 0)
+        known = {(n, c, j): (i, p, l) for i, n, c, j, p, l in con.execute("SELECT id, name, code, nth, price, listed FROM cards")}
+        points, changed, seen, added = [], [], set(), 0
+        for k, price in card_keys(CARDS_ROWS):
+            e = known.get(k)
+            if e is None:
+                cid = con.execute("INSERT INTO cards(name, code, nth, price) VALUES(?,?,?,?)", (*k, price)).lastrowid
+                points.append((cid, ts, price)); added += 1
+                continue
+            seen.add(e[0])
+            if not e[2] or e[1] != price:
+                points.append((e[0], ts, price)); changed.append((price, e[0]))
+        gone = [(e[0],) for e in known.values() if e[2] and e[0] not in seen]
+        points += [(cid, ts, None) for cid, in gone]
+        con.executemany("INSERT INTO prices(card, ts, price) VALUES(?,?,?)", points)
+        con.executemany("UPDATE cards SET price=?, listed=1 WHERE id=?", changed)
+        con.executemany("UPDATE cards SET price=NULL, listed=0 WHERE id=?", gone)
+        con.execute("INSERT INTO builds(ts, ver, n) VALUES(?,?,?)", (ts, CARDS_VER, len(CARDS_ROWS)))
+    print(f"[HIST] 新規{added} / 価格変更・再掲載{len(changed)} / 掲載終了{len(gone)} → {HISTORY_DB}"
+          f" {(time.perf_counter() - t0) * 1000:.0f}ms")
+
+def price_series(con, card_ids, points: int = HISTORY_POINTS) -> dict:
+    # カード id → 直近 points 点の [ビルド時刻, 価格]（古い順、スパークライン用）。1枚ごとに索引を後ろから辿るだけ
+    q = "SELECT ts, price FROM prices WHERE card=? ORDER BY ts DESC LIMIT ?"
+    return {cid: [list(r) for r in reversed(con.execute(q, (cid, points)).fetchall())] for cid in card_ids}
+
+def show_history(term: str):
+    # --history：カード名・型番に term を含むカード（最大50件）の価格推移を JSON で表示
+    from contextlib import closing
+    with closing(open_history()) as con:
+        hits = con.execute("SELECT id, name, code, nth FROM cards WHERE instr(code, ?) OR instr(name, ?) "
+                           "ORDER BY code, name, nth LIMIT 50", (term, term)).fetchall()
+        series = price_series(con, [h[0] for h in hits])
+    print("[" + ",\n".join(json.dumps({"name": n, "code": c, "nth": j, "points": series[i]}, ensure_ascii=False,
+                                       separators=(",",":")) for i, n, c, j in hits) + "]")
 
 # ====== CSS ======
 base_css = """
@@ -525,13 +1501,21 @@ header{
 
 /* -------- Controls (search) -------- */
 .controls{
-  display:grid; grid-template-columns:1fr 1fr; grid-template-areas:"q1 q2" "q3 q4" "acts acts";
+  display:grid; grid-template-columns:1fr 1fr; grid-template-areas:"q1 q2" "q3 q4" "acts acts" "fx fx";
   gap:14px; align-items:center; justify-content:center;
   max-width:var(--pane-w); width:100%; margin:12px auto 18px;
   background:#fff; border:1px solid var(--border); border-radius:12px; padding:16px 18px; box-shadow:0 4px 18px rgba(0,0,0,.04);
 }
 #nameQ{grid-area:q1} #codeQ{grid-area:q2} #packQ{grid-area:q3} #rarityQ{grid-area:q4}
 .controls .btns{ grid-area:acts; display:flex; gap:10px; flex-wrap:wrap; justify-content:center; }
+.facets{ grid-area:fx; border-top:1px dashed var(--border); padding-top:10px; }
+.facets summary{ cursor:pointer; font-weight:700; font-size:14px; }
+.facets .fx-price{ display:flex; gap:8px; align-items:center; margin:10px 0; }
+.facets fieldset{ border:1px solid var(--border); border-radius:8px; margin:0 0 10px; padding:6px 10px; }
+.facets legend{ font-size:13px; font-weight:700; padding:0 4px; }
+.facets .fx-list{ display:flex; flex-wrap:wrap; gap:4px 12px; max-height:160px; overflow:auto; font-size:13px; }
+.facets label{ display:inline-flex; gap:4px; align-items:center; white-space:nowrap; cursor:pointer; }
+.facets small{ color:#6b7280; }
 input.search{
   background:#fff; border:1px solid var(--border); color:#111; border-radius:var(--radius-btn);
   padding:12px 14px; font-size:16px; outline:none; width:100%;
@@ -569,6 +1553,7 @@ input.search::placeholder{ color:#9ca3af }
 .card{ background:var(--panel); border:1px solid var(--border); border-radius:var(--radius-card); overflow:hidden; }
 .th{ aspect-ratio:63/88; background:#f3f4f6; cursor:zoom-in }
 .th img{ width:100%; height:100%; object-fit:contain !important; display:block; background:#f3f4f6 }
+.th picture{ display:contents; }
 
 .b{ padding:10px; display:flex; flex-direction:column; min-height:160px; }
 .n{ font-size:15px; font-weight:800; line-height:1.25; margin:0 0 6px; color:#111; display:flex; gap:6px; align-items:flex-start; flex-wrap:wrap; word-break:break-word; }
@@ -1060,7 +2045,8 @@ button, .btn, .iconbtn, .notice-toggle{ touch-action:manipulation; -webkit-tap-h
 """
 # ===== JS =====
 base_js = r"""
-(function(){
+// データ（外部 cards.<ver>.json）の読込完了を待ってから起動。インライン時は即時
+(window.__CARDS_READY__||Promise.resolve()).then(function(){
   const LIFF_ID="__LIFF_ID__";
   const OA_ID="__OA_ID__";
 
@@ -1079,7 +2065,8 @@ base_js = r"""
 
   // Header height
   const header=document.querySelector('header');
-  const setHeaderH=()=>{ const h=header?.getBoundingClientRect().height||144; document.documentElement.style.setProperty('--header-h', Math.ceil(h)+'px'); };
+  let headerH=144;
+  const setHeaderH=()=>{ const h=headerH=header?.getBoundingClientRect().height||144; document.documentElement.style.setProperty('--header-h', Math.ceil(h)+'px'); };
   setHeaderH(); addEventListener('resize', setHeaderH); addEventListener('load', setHeaderH);
   document.querySelectorAll('header img').forEach(img=>{ if(!img.complete) img.addEventListener('load', setHeaderH); });
 
@@ -1098,6 +2085,37 @@ base_js = r"""
   const btnLatest = document.getElementById('btnLatest');
   let latestOnly = false;
 
+  // 追加：詳細検索（価格帯・レアリティ・弾）。FACETS=0 のビルドでは要素ごと無い
+  const priceMin=document.getElementById('priceMin'), priceMax=document.getElementById('priceMax'),
+        fxRarity=document.getElementById('fxRarity'), fxPack=document.getElementById('fxPack'),
+        fxClear=document.getElementById('fxClear');
+  // 追加：価格変動（前回ビルドとの差分）。changes.<版>.json は初めてボタンを押したときに読む
+  const btnChanged=document.getElementById('btnChanged'), CHANGES_URL=__CHANGES_URL__;
+  let changedOnly=false, changedIds=null;
+  // url の JSON を読む。fetch が使えない file:// や失敗時は同じ版の .js（window[name] 代入）を script で読む
+  function loadJSON(url, name){
+    const viaScript=()=>new Promise(r=>{ const s=document.createElement('script');
+      s.src=url.replace(/\.json$/,'.js'); s.onload=s.onerror=()=>r(window[name]); document.head.appendChild(s); });
+    return (location.protocol==='file:' || !window.fetch) ? viaScript()
+      : fetch(url,{credentials:'same-origin'}).then(r=>{ if(!r.ok) throw r.status; return r.json(); }).catch(viaScript);
+  }
+  function loadChanges(){
+    if(!loadChanges.p){
+      loadChanges.p=loadJSON(CHANGES_URL, '__CHANGES__').then(c=>{
+        const ids=c ? c.added.concat(c.up.map(x=>x[0]), c.down.map(x=>x[0]), (c.priced||[]).map(x=>x[0])) : [];
+        return changedIds=Int32Array.from(ids).sort();
+      });
+    }
+    return loadChanges.p;
+  }
+  function setChangedBtn(){
+    if(!btnChanged) return;
+    btnChanged.classList.toggle('active', changedOnly);
+    btnChanged.setAttribute('aria-pressed', changedOnly ? 'true' : 'false');
+  }
+  const priceBound=el=>{ const v=el ? el.value.trim() : ''; return v==='' || !isFinite(+v) ? null : +v; };
+  const checkedValues=box=>box ? [...box.querySelectorAll('input:checked')].map(x=>x.value) : [];
+
   function setLatestBtn(){
     if(!btnLatest) return;
     btnLatest.classList.toggle('active', latestOnly);
@@ -1244,7 +2262,8 @@ base_js = r"""
   }
 
   function totalPrice(){ return cart.reduce((s,i)=> s+(i.price||0)*(i.qty||1), 0); }
-  function escHtml(s){ return (s==null?'':String(s)).replace(/[&<>"']/g, m=>({"&":"&amp;","<":"&lt;",">":"&gt;","\"":"&quot;","'":"&#39;"}[m])); }
+  const ESC_MAP={"&":"&amp;","<":"&lt;",">":"&gt;","\"":"&quot;","'":"&#39;"}, escChar=m=>ESC_MAP[m];
+  function escHtml(s){ return (s==null?'':String(s)).replace(/[&<>"']/g, escChar); }
 
   function renderCartModal(){
     if(!cartList||!cartTotal) return;
@@ -1387,167 +2406,609 @@ base_js = r"""
   function setImgBtn(){ if(!btnImg) return; btnImg.textContent=showImages?'画像OFF':'画像ON'; btnImg.classList.toggle('active',showImages); btnImg.setAttribute('aria-pressed',showImages?'true':'false'); }
   function toggleImages(e){ if(e){e.preventDefault();e.stopPropagation();} showImages=!showImages; localStorage.setItem('showImages',showImages?'1':'0'); setImgBtn(); render(); }
 
+  // ★ 検索エンジン（正規化・データ・n-gram 索引・絞り込み・並び）。DOM には触れない
+  //   SEARCH_WORKER 時はこの関数のソースを Worker に渡して動かすので、関数の外の名前は使わない
+  function searchEngine(){
     // 正規化
-  const SEP_RE = /[\s\u30FB\u00B7·/／\-_—–−]+/g;
-
-  // ひらがな・カタカナ変換
-  function kataToHira(str){
-    return (str || '').replace(/[\u30A1-\u30FA]/g, ch =>
-      String.fromCharCode(ch.charCodeAt(0) - 0x60)
-    );
-  }
-
-  // ローマ字のゆらぎ吸収用（必要ならここに別名を追加）
-  const latinAliasMap = {
-    // 例：
-    // 'ex': 'ex',
-    // 'gx': 'gx',
-  };
-
-  // 漢字→読みの簡易マップ（必要ならここに追加）
-  const kanjiReadingMap = {
-    // 例：
-    // 'ポケモンカード': 'ぽけもんかーど',
-  };
-
-  function normalizeForSearch(s){
-    s = (s || '').normalize('NFKC').toLowerCase();
-    for (const [k, v] of Object.entries(latinAliasMap)){
-      s = s.split(k).join(v);
+    const SEP_RE = /[\s\u30FB\u00B7·/／\-_—–−]+/g;
+
+    // ひらがな・カタカナ変換
+    function kataToHira(str){
+      return (str || '').replace(/[\u30A1-\u30FA]/g, ch =>
+        String.fromCharCode(ch.charCodeAt(0) - 0x60)
+      );
     }
-    for (const [k, v] of Object.entries(kanjiReadingMap)){
-      s = s.split(k).join(v);
+
+    // ローマ字のゆらぎ吸収用（必要ならここに別名を追加）
+    const latinAliasMap = {
+      // 例：
+      // 'ex': 'ex',
+      // 'gx': 'gx',
+    };
+
+    // 漢字→読みの簡易マップ（必要ならここに追加）
+    const kanjiReadingMap = {
+      // 例：
+      // 'ポケモンカード': 'ぽけもんかーど',
+    };
+
+    function normalizeForSearch(s){
+      s = (s || '').normalize('NFKC').toLowerCase();
+      for (const [k, v] of Object.entries(latinAliasMap)){
+        s = s.split(k).join(v);
+      }
+      for (const [k, v] of Object.entries(kanjiReadingMap)){
+        s = s.split(k).join(v);
+      }
+      return kataToHira(s).replace(SEP_RE, '');
     }
-    return kataToHira(s).replace(SEP_RE, '');
-  }
-
-  function normalizeLatin(s){
-    s = (s || '')
-      .normalize('NFKC').toLowerCase()
-      .replace(/0/g,'o')
-      .replace(/1/g,'l')
-      .replace(/3/g,'e')
-      .replace(/4/g,'a')
-      .replace(/5/g,'s')
-      .replace(/7/g,'t')
-      .replace(SEP_RE,'')
-      .replace(/[^a-z0-9]/g,'');
-    return s;
-  }
-  function rarityKeyFromPair(kana, latin){
-    const k = kana  || ''; // normalizeForSearch 済み
-    const l = latin || ''; // normalizeLatin 済み
 
-    // promo系を1つにまとめる
-    if (l === 'promo' || l === 'p' || k === 'ぷろも') {
-      return 'promo';
+    function normalizeLatin(s){
+      s = (s || '')
+        .normalize('NFKC').toLowerCase()
+        .replace(/0/g,'o')
+        .replace(/1/g,'l')
+        .replace(/3/g,'e')
+        .replace(/4/g,'a')
+        .replace(/5/g,'s')
+        .replace(/7/g,'t')
+        .replace(SEP_RE,'')
+        .replace(/[^a-z0-9]/g,'');
+      return s;
     }
+    function rarityKeyFromPair(kana, latin){
+      const k = kana  || ''; // normalizeForSearch 済み
+      const l = latin || ''; // normalizeLatin 済み
 
-    // それ以外は「ラテン優先、なければかな側」
-    return l || k;
-  }
-  // データ
-  function norm(it){
-  return {
-    name:   it.n??it.name??"",
-    pack:   it.p??it.pack??"",
-    code:   it.c??it.code??"",
-    rarity: it.r??it.rarity??"",
-    booster:it.b??it.booster??"",
-    price:  (it.pr??it.price??null),
-    image:  it.i??it.image??"",
-    thumb:  it.t??it.thumb??"",
-    promo:  (it.k===1 || it.k===true) ? 1 : 0,
-    latest: (it.L===1 || it.L===true) ? 1 : 0,   // ★ ここ追加
-    s:      it.s??""
-  };
-}
+      // promo系を1つにまとめる
+      if (l === 'promo' || l === 'p' || k === 'ぷろも') {
+        return 'promo';
+      }
 
-  let ALL=Array.isArray(window.__CARDS__)?window.__CARDS__.map(norm):[];
-  if(!ALL.length){
-    const hint=document.createElement('p');
-    hint.style.cssText='color:#dc2626;padding:10px;margin:10px;border:1px dashed #fecaca;background:#fff5f5';
-    hint.textContent='データが0件です。入力CSV/Excelのヘッダと列位置を確認してください。';
-    document.querySelector('main')?.prepend(hint);
-  }
-  ALL=ALL.map(it=>({...it,
-    _name:normalizeForSearch(it.name||""), _code:normalizeForSearch(it.code||""), _packbooster:normalizeForSearch([it.pack||"",it.booster||""].join(" ")), _rarity:normalizeForSearch(it.rarity||""),
-    _name_lat:normalizeLatin(it.name||""), _code_lat:normalizeLatin(it.code||""), _packbooster_lat:normalizeLatin([it.pack||"",it.booster||""].join(" ")), _rarity_lat:normalizeLatin(it.rarity||"")
-  }));
+      // それ以外は「ラテン優先、なければかな側」
+      return l || k;
+    }
+    // データ：列ごとの配列（columns 形式）で持つ。行形式（[{n,p,c,...}]）も読み込み時に列へ変換
+    //   文字列列は {a:[...]}（そのまま）か {t:表, i:Int32Array(表の番号)}（辞書化）、価格は Float64Array（無し=NaN）、
+    //   強化/最新弾/サムネ幅違いはビット列（Uint8Array）
+    // ビルド側の検索キー（q）は別名マップが空＝正規化が Python と同じときだけ使う
+    const BUILD_KEYS_OK=!Object.keys(latinAliasMap).length && !Object.keys(kanjiReadingMap).length;
+    const SEARCH_KEY_NAMES=['_name','_name_lat','_code','_code_lat','_packbooster','_packbooster_lat','_rarity','_rarity_lat'];
+    const colGet=(c,i)=>(c.a ? c.a[i] : c.t[c.i[i]]) ?? '';
+    const hasBit=(bits,i)=>(bits[i>>3]>>(i&7))&1;
+    function bitsFromB64(b64, n){
+      const a=new Uint8Array((n+7)>>3);
+      if(b64){ const s=atob(b64); for(let i=0;i<s.length && i<a.length;i++) a[i]=s.charCodeAt(i); }
+      return a;
+    }
+    function strCol(x, cols){
+      if(Array.isArray(x)) return {a:x};
+      if(x && x.of && cols[x.of] && cols[x.of].i) return {t:x.t, i:cols[x.of].i};   // 同じ番号列を共有（例：rarity の検索キー）
+      if(x && Array.isArray(x.t)) return {t:x.t, i:Int32Array.from(x.i||[])};
+      return {a:[]};
+    }
+    function cardsFromColumns(d){
+      const n=d.n|0, D={n, key:{}, order:{}, rank:{}};
+      for(const f of ['name','code','pack','booster','rarity','image','thumb']) D[f]=strCol(d[f], D);
+      const pr=d.price||[]; D.price=new Float64Array(n);
+      for(let i=0;i<n;i++){ const v=pr[i]; D.price[i]=v==null ? NaN : v; }
+      const fl=d.flags||{};
+      D.promo=bitsFromB64(fl.k, n); D.latest=bitsFromB64(fl.L, n); D.tv=bitsFromB64(fl.v, n);
+      if(d.q) for(const k of SEARCH_KEY_NAMES) if(d.q[k]) D.key[k]=strCol(d.q[k], {_rarity:D.rarity, rarity:D.rarity});
+      const o=d.order||{};
+      for(const k of ['desc','asc']) if(Array.isArray(o[k]) && o[k].length===n) D.order[k]=Int32Array.from(o[k]);
+      return D;
+    }
+    function cardsFromRows(rows){
+      const n=rows.length, D={n, key:{}, order:{}, rank:{}};
+      const pick=(...ks)=>({a:rows.map(it=>{ for(const k of ks){ if(it[k]!=null) return it[k]; } return ""; })});
+      D.name=pick('n','name'); D.pack=pick('p','pack'); D.code=pick('c','code'); D.rarity=pick('r','rarity');
+      D.booster=pick('b','booster'); D.image=pick('i','image'); D.thumb=pick('t','thumb');
+      D.price=new Float64Array(n);
+      rows.forEach((it,i)=>{ const v=it.pr??it.price??null; D.price[i]=v==null||v==='' ? NaN : +v; });
+      D.promo=new Uint8Array((n+7)>>3); D.latest=new Uint8Array((n+7)>>3); D.tv=new Uint8Array((n+7)>>3);
+      rows.forEach((it,i)=>{
+        if(it.k===1 || it.k===true) D.promo[i>>3]|=1<<(i&7);
+        if(it.L===1 || it.L===true) D.latest[i>>3]|=1<<(i&7);
+        if(it.v===1) D.tv[i>>3]|=1<<(i&7);
+      });
+      if(rows.length && rows.every(it=>Array.isArray(it.q) && it.q.length===SEARCH_KEY_NAMES.length))
+        SEARCH_KEY_NAMES.forEach((k,j)=>{ D.key[k]={a:rows.map(it=>it.q[j])}; });
+      return D;
+    }
+    // 分割ペイロード（CARDS_MODE=shards）：届いた片を全体の id 順に1つの列データへまとめる
+    //   片は {id:[先頭id, 差分, ...], d:列形式 or 行形式}。まだ全部そろっていないときは D.gid（番号 → 全体の id）を持つ
+    function mergeStr(cs, pos, n){
+      // 全部が辞書化列なら表をまとめて番号を振り直す（maps[片][元の番号] = 新しい番号）。それ以外は文字列配列
+      if(cs.every(c=>c.t)){
+        const t=[], at=new Map(), ix=new Int32Array(n);
+        const maps=cs.map((c,j)=>{
+          const m=c.t.map(v=>{ let k=at.get(v); if(k===undefined){ k=t.length; t.push(v); at.set(v,k); } return k; });
+          const to=pos[j];
+          for(let r=0;r<to.length;r++) ix[to[r]]=m[c.i[r]];
+          return m;
+        });
+        return {col:{t, i:ix}, maps};
+      }
+      const a=new Array(n);
+      cs.forEach((c,j)=>{ const to=pos[j]; for(let r=0;r<to.length;r++) a[to[r]]=colGet(c,r); });
+      return {col:{a}, maps:null};
+    }
+    function cardsFromShards(total, parts){
+      const ds=parts.map(p=>{
+        const d=Array.isArray(p.d) ? cardsFromRows(p.d) : cardsFromColumns(p.d);
+        d.gid=new Int32Array(d.n);
+        for(let r=0, g=0;r<d.n;r++){ g+=p.id[r]; d.gid[r]=g; }
+        return d;
+      });
+      if(ds.length===1){ if(ds[0].n===total) ds[0].gid=null; return ds[0]; }   // 1片ならそのまま（片の中は id 順）
+      const at=new Int32Array(total).fill(-1);
+      for(const d of ds) for(let r=0;r<d.n;r++) at[d.gid[r]]=0;
+      let n=0;
+      for(let g=0;g<total;g++) if(at[g]===0) at[g]=n++;
+      const D={n, key:{}, order:{}, rank:{}, gid:null};
+      if(n<total){ D.gid=new Int32Array(n); for(let g=0, k=0;g<total;g++) if(at[g]>=0) D.gid[k++]=g; }
+      const pos=ds.map(d=>{ const to=new Int32Array(d.n); for(let r=0;r<d.n;r++) to[r]=at[d.gid[r]]; return to; });
+      let R=null;
+      for(const f of ['name','code','pack','booster','rarity','image','thumb']){
+        const m=mergeStr(ds.map(d=>d[f]), pos, n);
+        D[f]=m.col; if(f==='rarity') R=m;
+      }
+      D.price=new Float64Array(n);
+      D.promo=new Uint8Array((n+7)>>3); D.latest=new Uint8Array((n+7)>>3); D.tv=new Uint8Array((n+7)>>3);
+      ds.forEach((d,j)=>{
+        const to=pos[j];
+        for(let r=0;r<d.n;r++){
+          const i=to[r], b=1<<(i&7);
+          D.price[i]=d.price[r];
+          if(hasBit(d.promo,r)) D.promo[i>>3]|=b;
+          if(hasBit(d.latest,r)) D.latest[i>>3]|=b;
+          if(hasBit(d.tv,r)) D.tv[i>>3]|=b;
+        }
+      });
+      for(const k of SEARCH_KEY_NAMES){
+        const cs=ds.map(d=>d.key[k]);
+        if(cs.some(c=>!c)) continue;   // 欠けていれば use() がまとめて作り直す
+        if(R.maps && cs.every((c,j)=>c.i && c.i===ds[j].rarity.i)){   // レアリティと番号列を共有したまま
+          const t=new Array(D.rarity.t.length);
+          cs.forEach((c,j)=>c.t.forEach((v,x)=>{ t[R.maps[j][x]]=v; }));
+          D.key[k]={t, i:D.rarity.i};
+        } else D.key[k]=mergeStr(cs, pos, n).col;
+      }
+      return D;   // 価格順の順列は use() が作る
+    }
+    // forSearch=false：表示用の列だけ（Worker 検索時のメインスレッド）。検索キー・順列は持たない
+    //   {fmt:'shards', n:全件数, parts:[片...], add:true} は前回までの片に足してまとめ直す
+    let PARTS=[];
+    function loadCards(x, forSearch){
+      if(x && x.fmt==='shards') PARTS=x.add ? PARTS.concat(x.parts) : x.parts.slice();
+      const d = Array.isArray(x) ? cardsFromRows(x)
+              : (x && x.fmt==='cols') ? cardsFromColumns(x)
+              : (x && x.fmt==='shards') ? cardsFromShards(x.n|0, PARTS) : cardsFromRows([]);
+      if(forSearch===false){ d.key={}; d.order={}; return d; }
+      use(d);
+      return d;
+    }
+    // 検索対象のデータを差し替える。検索キーが無い / 使えないときだけブラウザで正規化
+    let D=cardsFromRows([]), CAND_MARK=new Uint8Array(0);
+    function use(d){
+      D=d; SIDX=null; SHORT_CACHE.clear();
+      if(SIDX_SRC) useIndex(SIDX_SRC);   // 件数がそろった（分割ペイロードを読み終えた）ら索引を使い始める
+      CAND_MARK=new Uint8Array(D.n);   // 候補の目印（使い終わったら 0 に戻す）
+      if(!BUILD_KEYS_OK || SEARCH_KEY_NAMES.some(k=>!D.key[k])){
+        const each=f=>({a:Array.from({length:D.n}, (_,i)=>f(i))});
+        const pb=i=>[colGet(D.pack,i),colGet(D.booster,i)].join(" ");
+        D.key={
+          _name:each(i=>normalizeForSearch(colGet(D.name,i))),       _name_lat:each(i=>normalizeLatin(colGet(D.name,i))),
+          _code:each(i=>normalizeForSearch(colGet(D.code,i))),       _code_lat:each(i=>normalizeLatin(colGet(D.code,i))),
+          _packbooster:each(i=>normalizeForSearch(pb(i))),           _packbooster_lat:each(i=>normalizeLatin(pb(i))),
+          _rarity:each(i=>normalizeForSearch(colGet(D.rarity,i))),   _rarity_lat:each(i=>normalizeLatin(colGet(D.rarity,i))),
+        };
+      }
+      // 価格順の順列がペイロードに無い（行形式など）ときは読み込み時に1回だけ作る
+      //   価格なしは 0 扱い＝従来の (price||0)、同額は番号順
+      if(!D.order.desc || !D.order.asc){
+        const P=new Float64Array(D.n);
+        for(let i=0;i<D.n;i++) P[i]=D.price[i]||0;
+        const ids=()=>{ const a=new Int32Array(D.n); for(let i=0;i<D.n;i++) a[i]=i; return a; };
+        D.order.desc=ids().sort((a,b)=>(P[b]-P[a]) || (a-b));
+        D.order.asc=ids().sort((a,b)=>(P[a]-P[b]) || (a-b));
+      }
+    }
+    // 順列内の位置（少数の該当だけを並べるとき用、初回に作る）
+    function orderRank(sort){
+      let r=D.rank[sort];
+      if(!r){
+        const o=D.order[sort]; r=new Int32Array(D.n);
+        for(let j=0;j<o.length;j++) r[o[j]]=j;
+        D.rank[sort]=r;
+      }
+      return r;
+    }
 
-  // 検索 & ソート
-  let VIEW=[], page=1, currentSort=__INITIAL_SORT__;
-  function matchEither(kana,latin,qK,qL){ if(!qK && !qL) return true; let ok=false; if(qK && kana.includes(qK)) ok=true; if(qL && latin.includes(qL)) ok=true; return ok; }
+    // ★ n-gram 索引（ビルド時に生成）。postings の積集合で候補を絞り、最後は従来どおり includes で確認
+    //   索引がまだ届いていない / 件数が合わない / 別名マップを足した（ビルド側と正規化がずれる）ときは全件走査
+    let SIDX=null, SIDX_SRC=null;
+    const SIDX_OK=BUILD_KEYS_OK;
+    const SIDX_ENOUGH=64;   // 候補がこれ以下になったら積集合を打ち切って includes に任せる
+    const NO_IDS=new Int32Array(0);
+    function useIndex(x){
+      SIDX_SRC=x;
+      if(SIDX_OK && x && x.f && x.n>0 && x.c===D.n && !D.gid) SIDX=x;
+    }
 
-  function apply(){
-  // 正規化済みクエリ
-  const qNameK   = normalizeForSearch(nameQ.value || '');
-  const qCodeK   = normalizeForSearch(codeQ.value || '');
-  const qPackK   = normalizeForSearch(packQ.value || '');
-  const qRarityK = normalizeForSearch(rarityQ.value || '');
-
-  const qNameL   = normalizeLatin(nameQ.value || '');
-  const qCodeL   = normalizeLatin(codeQ.value || '');
-  const qPackL   = normalizeLatin(packQ.value || '');
-  const qRarityL = normalizeLatin(rarityQ.value || '');
-
-  const rawName   = nameQ.value || '';
-  const nameHasJP = /[\u3040-\u30ff\u3400-\u9fff]/.test(rawName);
-  const nameHasEN = /[A-Za-z0-9]/.test(rawName);
-
-  // ★ レアリティ入力を「比較用キー」に変換
-  const rarityQueryKey =
-    (qRarityK || qRarityL)
-      ? rarityKeyFromPair(qRarityK, qRarityL)
-      : '';
-
-  VIEW = ALL.filter(it => {
-    // 名前（既存ロジック）
-    let okName = true;
-    if (rawName) {
-      if (nameHasJP && nameHasEN) {
-        okName = it._name.includes(qNameK);
-      } else if (nameHasJP) {
-        okName = it._name.includes(qNameK);
-      } else {
-        okName = it._name_lat.includes(qNameL);
+    // 索引の {キー:[先頭id, 差分, ...]} から id 列（昇順）を引く
+    function idList(m, g){
+      if(!m || !Object.prototype.hasOwnProperty.call(m,g)) return NO_IDS;
+      let p=m[g];
+      if(!(p instanceof Int32Array)){   // 差分 → 絶対 id（初回だけ）
+        const a=new Int32Array(p.length); let x=0;
+        for(let i=0;i<p.length;i++){ x+=p[i]; a[i]=x; }
+        m[g]=p=a;
+      }
+      return p;
+    }
+    function postings(field, g){ return idList(SIDX.f[field], g); }
+    function intersectIds(a,b){
+      const out=new Int32Array(Math.min(a.length,b.length)); let i=0,j=0,k=0;
+      while(i<a.length && j<b.length){ const x=a[i], y=b[j]; if(x===y){ out[k++]=x; i++; j++; } else if(x<y) i++; else j++; }
+      return out.subarray(0,k);
+    }
+    function unionIds(a,b){
+      if(!a || !b) return null;
+      const out=new Int32Array(a.length+b.length); let i=0,j=0,k=0;
+      while(i<a.length || j<b.length){
+        if(j>=b.length || (i<a.length && a[i]<b[j])) out[k++]=a[i++];
+        else if(i>=a.length || b[j]<a[i]) out[k++]=b[j++];
+        else { out[k++]=a[i++]; j++; }
+      }
+      return out.subarray(0,k);
+    }
+    function andIds(a,b){ return a===null ? b : b===null ? a : intersectIds(a,b); }
+    // 全体の id 列（昇順）→ 読み込み済みの片の中での番号（分割ペイロードを読んでいる途中）
+    function localIds(ids){
+      const g=D.gid, out=new Int32Array(Math.min(ids.length, g.length)); let i=0, j=0, k=0;
+      while(i<ids.length && j<g.length){ if(ids[i]===g[j]){ out[k++]=j; i++; j++; } else if(ids[i]<g[j]) i++; else j++; }
+      return out.subarray(0,k);
+    }
+    // n 文字未満の検索語：q を含むキーすべての和集合（同じ語の再入力に備えて少しだけ覚える）
+    const SHORT_CACHE=new Map();
+    function shortCandidates(field, q){
+      const key=field+'\u0000'+q; let c=SHORT_CACHE.get(key);
+      if(c) return c;
+      const m=SIDX.f[field]; if(!m) return NO_IDS;
+      const mark=new Uint8Array(D.n); let k=0;
+      for(const g in m){
+        if(!g.includes(q)) continue;
+        const p=postings(field,g);
+        for(let i=0;i<p.length;i++){ if(!mark[p[i]]){ mark[p[i]]=1; k++; } }
       }
+      c=new Int32Array(k);
+      for(let i=0,j=0;i<mark.length;i++) if(mark[i]) c[j++]=i;
+      if(SHORT_CACHE.size>=64) SHORT_CACHE.clear();
+      SHORT_CACHE.set(key,c);
+      return c;
+    }
+    // q を含む可能性がある id（昇順）。索引が無いなら null＝全件
+    function candidateIds(field, q){
+      if(!SIDX || !q) return null;
+      const cps=Array.from(q), n=SIDX.n;
+      if(cps.length<n) return shortCandidates(field, q);
+      const seen=new Set(), lists=[];
+      for(let i=0;i+n<=cps.length;i++){
+        const g=cps.slice(i,i+n).join('');
+        if(!seen.has(g)){ seen.add(g); lists.push(postings(field,g)); }
+      }
+      lists.sort((a,b)=>a.length-b.length);
+      let c=lists[0];
+      for(let i=1;i<lists.length && c.length>SIDX_ENOUGH;i++) c=intersectIds(c,lists[i]);
+      return c;
+    }
+    // 「かな側 or ラテン側」の候補（eitherTest に対応）
+    function candidateEither(field, qK, qL){
+      if(!qK && !qL) return null;
+      if(qK && qL) return unionIds(candidateIds(field,qK), candidateIds(field+'_lat',qL));
+      return qK ? candidateIds(field,qK) : candidateIds(field+'_lat',qL);
     }
 
-    const okCode = matchEither(
-      it._code, it._code_lat,
-      qCodeK,   qCodeL
-    );
-
-    const okPack = matchEither(
-      it._packbooster, it._packbooster_lat,
-      qPackK,          qPackL
-    );
-
-    // ★ レアリティ：完全一致（でも promo 系はまとめて判定）
-    let okRarity = true;
-    if (rarityQueryKey) {
-      const itemRarityKey = rarityKeyFromPair(it._rarity, it._rarity_lat);
-      okRarity = (itemRarityKey === rarityQueryKey);
+    // 検索 & ソート
+    const ORDER_WALK_RATIO=16;             // 候補が全件の 1/16 未満なら順列を辿らず位置で並べる
+    // 列 c の値が q を含むか（辞書化列は表の各語で1回だけ判定）
+    function includesTest(c, q){
+      if(c.a){ const a=c.a; return i=>a[i].includes(q); }
+      const t=c.t, ok=new Uint8Array(t.length), codes=c.i;
+      for(let j=0;j<t.length;j++) ok[j]=t[j].includes(q) ? 1 : 0;
+      return i=>ok[codes[i]]===1;
+    }
+    // かな側・ラテン側のどちらかが含めば一致（空の側は見ない）
+    function eitherTest(cK, cL, qK, qL){
+      const tK=qK ? includesTest(cK,qK) : null, tL=qL ? includesTest(cL,qL) : null;
+      return i=>(tK!==null && tK(i)) || (tL!==null && tL(i));
+    }
+    function rarityTest(key){
+      const cK=D.key._rarity, cL=D.key._rarity_lat;
+      if(cK.i && cK.i===cL.i){   // 同じ番号列：レアリティの種類ごとに1回
+        const ok=new Uint8Array(cK.t.length), codes=cK.i;
+        for(let j=0;j<ok.length;j++) ok[j]=rarityKeyFromPair(cK.t[j], cL.t[j])===key ? 1 : 0;
+        return i=>ok[codes[i]]===1;
+      }
+      return i=>rarityKeyFromPair(colGet(cK,i), colGet(cL,i))===key;
     }
 
-    const okLatest = !latestOnly || it.latest === 1;
+    // ★ 詳細検索：レアリティ（rarityKeyFromPair のキー）・弾（「弾 / 封入パック」）ごとの id 列（昇順）
+    //   値の一覧と件数はビルド時にページへ埋め込み済み。id 列は索引（"x"）にあればそれを使い、
+    //   無ければ（索引が届く前・分割ペイロードの読み込み途中など）初回に1回の走査で値 → id 列を作って使い回す
+    function facetKeyOf(field){
+      if(field==='rarity'){
+        const cK=D.key._rarity, cL=D.key._rarity_lat;
+        return i=>rarityKeyFromPair(colGet(cK,i), colGet(cL,i));
+      }
+      return i=>{ const p=colGet(D.pack,i), b=colGet(D.booster,i); return p && b ? p+' / '+b : (p || b); };
+    }
+    function facetIds(field, value){
+      if(SIDX && SIDX.x && SIDX.x[field]) return idList(SIDX.x[field], value);
+      const fx=D.facet || (D.facet={});
+      let m=fx[field];
+      if(!m){
+        const keyOf=facetKeyOf(field), keys=new Array(D.n), count=new Map();
+        for(let i=0;i<D.n;i++){ const k=keyOf(i); keys[i]=k; count.set(k, (count.get(k)||0)+1); }
+        const fill=new Map(); m=new Map();
+        for(const [k,c] of count){ m.set(k, new Int32Array(c)); fill.set(k, 0); }
+        for(let i=0;i<D.n;i++){ const k=keys[i], j=fill.get(k); m.get(k)[j]=i; fill.set(k, j+1); }
+        fx[field]=m;
+      }
+      return m.get(value) || NO_IDS;
+    }
+    // 選んだ値のどれか（和集合）。何も選んでいなければ null＝絞り込まない
+    function facetCandidates(field, values){
+      if(!values || !values.length) return null;
+      let c=NO_IDS;
+      for(const v of values) c=unionIds(c, facetIds(field, v));
+      return c;
+    }
+    // 価格順の順列 o の中で lo ≦ 価格 ≦ hi が並ぶ範囲 [from, to)（二分探索）。順列の価格なしは 0 の位置にいる
+    function priceSpan(o, lo, hi){
+      const P=j=>D.price[o[j]] || 0, desc=o===D.order.desc;
+      const first=f=>{ let a=0, b=o.length; while(a<b){ const m=(a+b)>>1; if(f(P(m))) b=m; else a=m+1; } return a; };
+      const [from, to] = desc ? [first(p=>p<=hi), first(p=>p<lo)] : [first(p=>p>=lo), first(p=>p>hi)];
+      return [from, Math.max(from, to)];   // 下限 > 上限なら空
+    }
 
-    return okName && okCode && okPack && okRarity
-           && (!promoOnly || it.promo === 1)  // ← これは「強化買取中!!」ボタン用フラグ。元のまま。
-           && okLatest;
-  });
+    // 入力 → 該当カードの番号列（並び順どおり）
+    //   s = {name, code, pack, rarity, latest, promo, sort, min, max, rarities, packs}
+    //   min / max は価格の下限・上限（null で無制限）、rarities / packs は詳細検索で選んだ値の配列
+    //   ids は対象を限る昇順の id 列（null で全件）
+    function query(s){
+      // 正規化済みクエリ
+      const qNameK   = normalizeForSearch(s.name || '');
+      const qCodeK   = normalizeForSearch(s.code || '');
+      const qPackK   = normalizeForSearch(s.pack || '');
+      const qRarityK = normalizeForSearch(s.rarity || '');
+
+      const qNameL   = normalizeLatin(s.name || '');
+      const qCodeL   = normalizeLatin(s.code || '');
+      const qPackL   = normalizeLatin(s.pack || '');
+      const qRarityL = normalizeLatin(s.rarity || '');
+
+      const rawName   = s.name || '';
+      const nameHasJP = /[\u3040-\u30ff\u3400-\u9fff]/.test(rawName);
+
+      // ★ レアリティ入力を「比較用キー」に変換
+      const rarityQueryKey =
+        (qRarityK || qRarityL)
+          ? rarityKeyFromPair(qRarityK, qRarityL)
+          : '';
+
+      let cand = null;
+      if (rawName) cand = nameHasJP ? candidateIds('name', qNameK) : candidateIds('name_lat', qNameL);
+      cand = andIds(cand, candidateEither('code', qCodeK, qCodeL));
+      cand = andIds(cand, candidateEither('pack', qPackK, qPackL));
+      cand = andIds(cand, facetCandidates('rarity', s.rarities));
+      cand = andIds(cand, facetCandidates('pack', s.packs));
+      if (s.ids) cand = andIds(cand, D.gid ? localIds(s.ids) : s.ids);   // 価格変動：前回ビルドから変わったカード（昇順の id 列）
+
+      // 条件ごとの判定関数（名前は日本語を含めばかな側、なければラテン側）
+      const tests = [];
+      if (rawName) tests.push(nameHasJP ? includesTest(D.key._name, qNameK) : includesTest(D.key._name_lat, qNameL));
+      if (qCodeK || qCodeL) tests.push(eitherTest(D.key._code, D.key._code_lat, qCodeK, qCodeL));
+      if (qPackK || qPackL) tests.push(eitherTest(D.key._packbooster, D.key._packbooster_lat, qPackK, qPackL));
+      // ★ レアリティ：完全一致（でも promo 系はまとめて判定）
+      if (rarityQueryKey) tests.push(rarityTest(rarityQueryKey));
+      if (s.latest) tests.push(i => hasBit(D.latest, i) === 1);
+      if (s.promo)  tests.push(i => hasBit(D.promo, i) === 1);   // ← 「強化買取中!!」ボタン用フラグ
+      // 価格帯：価格なしは範囲指定があれば対象外（NaN は比較がすべて偽）
+      const ranged = s.min != null || s.max != null;
+      const lo = s.min != null ? +s.min : -Infinity, hi = s.max != null ? +s.max : Infinity;
+      if (ranged) tests.push(i => { const p = D.price[i]; return p >= lo && p <= hi; });
+
+      // 価格順は並べ替えず、ビルド時の順列を先頭から辿って該当だけ拾う（同額は番号順で常に同じ並び）
+      //   価格帯があれば順列（並びなしなら昇順）の該当範囲だけを二分探索で切り出して辿る
+      const order = (s.sort === 'desc' || s.sort === 'asc') ? D.order[s.sort] : null;
+      const walk = ranged ? (order || D.order.asc) : order;
+      const [from, to] = ranged ? priceSpan(walk, lo, hi) : [0, D.n];
+      const pass = i => { for (let t = 0; t < tests.length; t++) { if (!tests[t](i)) return false; } return true; };
+      const hit = new Int32Array(cand ? Math.min(cand.length, to - from) : to - from);
+      let k = 0;
+      if (cand && (!walk || cand.length * ORDER_WALK_RATIO < to - from)) {
+        // 候補が少ない：候補だけ判定し、順列内の位置で並べる
+        for (let j = 0; j < cand.length; j++) { const i = cand[j]; if (pass(i)) hit[k++] = i; }
+        if (order) { const r = orderRank(s.sort); hit.subarray(0, k).sort((a,b)=>r[a]-r[b]); }
+        return hit.subarray(0, k);
+      }
+      if (cand) {
+        for (let j = 0; j < cand.length; j++) CAND_MARK[cand[j]] = 1;
+        for (let j = from; j < to; j++) { const i = walk[j]; if (CAND_MARK[i] && pass(i)) hit[k++] = i; }
+        for (let j = 0; j < cand.length; j++) CAND_MARK[cand[j]] = 0;
+      } else {
+        for (let j = from; j < to; j++) { const i = walk ? walk[j] : j; if (pass(i)) hit[k++] = i; }
+      }
+      if (walk && !order) hit.subarray(0, k).sort();   // 並びなしの価格帯検索は番号順に戻す
+      return hit.subarray(0, k);
+    }
+    // 番号列 view の表示範囲：w={page, per}（ページャ。範囲外は端のページに寄せる）か w={from, to}（仮想スクロール）
+    function windowOf(view, w){
+      if(w.page==null) return {page:0, from:w.from, total:view.length, ids:view.subarray(w.from, w.to)};
+      const pages=Math.max(1, Math.ceil(view.length/w.per));
+      const p=Math.min(Math.max(1, w.page|0), pages), from=(p-1)*w.per;
+      return {page:p, from, total:view.length, ids:view.subarray(from, from+w.per)};
+    }
 
-  if (currentSort === 'desc') {
-    VIEW.sort((a,b)=>(b.price||0)-(a.price||0));
-  } else if (currentSort === 'asc') {
-    VIEW.sort((a,b)=>(a.price||0)-(b.price||0));
+    return {normalizeForSearch, normalizeLatin, colGet, hasBit, load:loadCards, use, useIndex, query, windowOf};
+  }
+
+  const E=searchEngine(), colGet=E.colGet, hasBit=E.hasBit;
+
+  // ★ Worker 検索（SEARCH_WORKER）：絞り込み・並び・ページ分けを Worker で行い、表示するページの番号だけ受け取る
+  //   '1'=常に / 'auto'=低コア端末・スマホだけ / '0'=使わない。Worker を作れない・落ちたときはメインスレッドで検索
+  const SEARCH_WORKER=__SEARCH_WORKER__;
+  const WORKER_SRC=`const E=(${searchEngine})();let VIEW=new Int32Array(0);
+onmessage=function(e){const m=e.data;
+if(m.type==='cards'){E.load(m.cards);return;}
+if(m.type==='index'){E.useIndex(m.index);return;}
+if(m.type==='query')VIEW=E.query(m.q);
+const r=E.windowOf(VIEW,m.win),ids=r.ids.slice();
+postMessage({gen:m.gen,page:r.page,from:r.from,total:r.total,ids:ids},[ids.buffer]);};`;
+  let worker=null;
+  if((SEARCH_WORKER==='1' || (SEARCH_WORKER==='auto' && (cores<=4 || isMobile()))) && typeof Worker==='function'){
+    try{ worker=new Worker(URL.createObjectURL(new Blob([WORKER_SRC], {type:'text/javascript'}))); }catch(_){ worker=null; }
+  }
+
+  // データ：Worker 検索時はメインスレッドは表示用の列だけ持ち、検索キー・順列・索引は Worker 側
+  //   分割ペイロードでは片が届くたびに差し替わる（addShards）
+  let D=E.load(window.__CARDS__, !worker);
+  if(worker) worker.postMessage({type:'cards', cards:window.__CARDS__});
+  const SHARDS=window.__CARDS__ && window.__CARDS__.fmt==='shards' ? window.__SHARDS__ : null, SHARD_URL=__SHARD_URL__;
+  const SHARD_DONE=new Set(SHARDS && window.__CARDS__.parts.length ? [0] : []), SHARD_P=new Map();
+  window.__CARDS__=null;   // 元の JSON はもう使わないので手放す
+  if(!D.n){
+    const hint=document.createElement('p');
+    hint.style.cssText='color:#dc2626;padding:10px;margin:10px;border:1px dashed #fecaca;background:#fff5f5';
+    hint.textContent='データが0件です。入力CSV/Excelのヘッダと列位置を確認してください。';
+    document.querySelector('main')?.prepend(hint);
   }
+  // 価格の表示文字列（¥1,234 / 価格なしは -）と桁数。カードごとに初回だけ作る
+  const PRICE_FMT=new Intl.NumberFormat();
+  let PRICE_LABEL=new Array(D.n), PRICE_DIGITS=new Uint8Array(D.n);
+  function priceLabel(i){
+    let s=PRICE_LABEL[i];
+    if(s===undefined){
+      const p=D.price[i];
+      if(Number.isNaN(p)){ s='-'; }
+      else{ const v=parseInt(p,10); s='¥'+PRICE_FMT.format(v); PRICE_DIGITS[i]=String(v).replace(/\D/g,'').length; }
+      PRICE_LABEL[i]=s;
+    }
+    return s;
+  }
+  // 桁数 → 価格のクラス（SP は 7 桁から小さく）
+  const MX_CLASS_PC=[], MX_CLASS_SP=[];
+  for(let d=0; d<=9; d++){
+    MX_CLASS_PC.push(d>=9 ? 'mx ultra' : d>=8 ? 'mx shrink' : 'mx');
+    MX_CLASS_SP.push(d>=9 ? 'mx ultra' : d>=8 ? 'mx shrink' : d>=7 ? 'mx m7' : 'mx');
+  }
+
+  // n-gram 索引：届いたら検索側（Worker かこのスレッド）へ
+  function giveIndex(){
+    const x=window.__SEARCH_IDX__;
+    if(!x) return;
+    if(worker){ worker.postMessage({type:'index', index:x}); window.__SEARCH_IDX__=null; }
+    else E.useIndex(x);
+  }
+  giveIndex();
+  if(window.__SEARCH_READY__) window.__SEARCH_READY__.then(giveIndex);
+
+  // 検索 & ソート。表示中の範囲は該当件数（hitTotal）・先頭位置（winFrom）・そのカード番号（pageIds）
+  let VIEW=new Int32Array(0), page=1, currentSort=__INITIAL_SORT__;
+  let hitTotal=0, winFrom=0, pageIds=VIEW;
+  let gen=0;   // Worker への問い合わせの世代。最新以外の返事は捨てる
+  function querySpec(){
+    return {name:nameQ.value||'', code:codeQ.value||'', pack:packQ.value||'', rarity:rarityQ.value||'',
+            latest:latestOnly, promo:promoOnly, sort:currentSort,
+            min:priceBound(priceMin), max:priceBound(priceMax), rarities:checkedValues(fxRarity), packs:checkedValues(fxPack),
+            ids:changedOnly ? changedIds : null};
+  }
+  function showWindow(r){
+    if(r.page) page=r.page;
+    hitTotal=r.total; winFrom=r.from; pageIds=r.ids;
+    render();
+  }
+  // ★ 分割ペイロード（CARDS_MODE=shards）：最初は先頭の片（最新弾・強化買取・価格の両端）だけで表示し、
+  //   残りの片は裏で読んでまとめ直す。弾・価格帯の条件で要る片が目録から絞れるときは、その片を先に読んでから検索
+  let shardWait=0;   // 片待ちの apply の世代。後から apply されたら待っていた分は捨てる
+  function addShards(js){
+    js=js.filter(j=>!SHARD_DONE.has(j));
+    if(!js.length) return Promise.resolve(false);
+    return Promise.all(js.map(j=>{
+      let p=SHARD_P.get(j);
+      if(!p){ const v=SHARDS.s[j].v; p=loadJSON(SHARD_URL.replace('*', v), '__SHARD_'+v+'__'); SHARD_P.set(j, p); }
+      return p;
+    })).then(parts=>{
+      const fresh=[];
+      js.forEach((j,k)=>{
+        if(SHARD_DONE.has(j)) return;   // 並行して読んだ別の呼び出しが足し済み
+        SHARD_DONE.add(j);              // 読めなかった片も済み扱い（待ち続けない）
+        if(parts[k]) fresh.push(parts[k]);
+      });
+      if(!fresh.length) return false;
+      const x={fmt:'shards', n:SHARDS.n, parts:fresh, add:true};
+      D=E.load(x, !worker);
+      if(worker) worker.postMessage({type:'cards', cards:x});
+      PRICE_LABEL=new Array(D.n); PRICE_DIGITS=new Uint8Array(D.n);
+      refresh();   // VIEW（Worker 側も）は前の D の番号なので、呼び出し元によらず必ず検索し直す
+      return true;
+    });
+  }
+  function shardPacks(m){
+    // 目録の [弾, 封入パック] → [「弾 / 封入パック」, 検索キー（かな）, 検索キー（ラテン）]（片ごとに初回だけ）
+    return m.pk || (m.pk=m.p.map(([p,b])=>{ const pb=p+' '+b;
+      return [p && b ? p+' / '+b : (p || b), E.normalizeForSearch(pb), E.normalizeLatin(pb)]; }));
+  }
+  // 条件 s に該当しうる片のうち未読のもの。未読の全部が要る（絞れない）なら [] ＝今ある分で出して裏の読み込みを待つ
+  //   最新弾・強化買取のカードは先頭の片にすべて入っている。価格帯の検索では価格なしのカードは対象外
+  function shardsNeeded(s){
+    const rest=SHARDS.s.map((_,j)=>j).filter(j=>!SHARD_DONE.has(j));
+    const qK=E.normalizeForSearch(s.pack||''), qL=E.normalizeLatin(s.pack||'');
+    const ranged=s.min!=null || s.max!=null;
+    const lo=s.min!=null ? s.min : -Infinity, hi=s.max!=null ? s.max : Infinity;
+    const need=rest.filter(j=>{
+      const m=SHARDS.s[j];
+      if(s.latest || s.promo) return false;
+      if(ranged && (m.hi==null || m.hi<lo || m.lo>hi)) return false;
+      if(s.packs && s.packs.length && !shardPacks(m).some(x=>s.packs.includes(x[0]))) return false;
+      return !(qK || qL) || shardPacks(m).some(x=>(qK && x[1].includes(qK)) || (qL && x[2].includes(qL)));
+    });
+    return need.length<rest.length ? need : [];
+  }
+  // データが増えたら（addShards）、今の条件・今の表示位置のまま検索し直す
+  function refresh(){ request(VIRTUAL ? vsWindow() : {page, per:PER_PAGE_ADJ}, querySpec()); }
 
-  page = 1;
-  render();
-}
-
+  // 表示範囲 win を出す（q があれば先に検索し直す）
+  function request(win, q){
+    if(worker){ worker.postMessage({type:q ? 'query' : 'win', gen:++gen, q, win}); return; }
+    if(q) VIEW=E.query(q);
+    showWindow(E.windowOf(VIEW, win));
+  }
+  function apply(){
+    const q=querySpec(), t=++shardWait;
+    if(SHARDS && SHARD_DONE.size<SHARDS.s.length){
+      const need=shardsNeeded(q);
+      if(need.length){ addShards(need).then(()=>{ if(t===shardWait) apply(); }); return; }
+    }
+    if(VIRTUAL){ vsToTop(); request(vsWindow(), q); return; }
+    request({page:1, per:PER_PAGE_ADJ}, q);
+  }
+  function goPage(p){ request({page:p, per:PER_PAGE_ADJ}); }
+  if(worker){
+    worker.onmessage=(e)=>{
+      const m=e.data;
+      if(m.gen!==gen) return;
+      showWindow(m);
+    };
+    worker.onerror=()=>{
+      // 以後はこのスレッドで検索（検索キー・順列は表示用の列から作り直す。索引は手放し済みなら全件走査）
+      worker.terminate(); worker=null;
+      E.use(D); giveIndex(); apply();
+    };
+  }
 
   // Pager
   function buildPageButtons(cur,total){
@@ -1571,52 +3032,56 @@ base_js = r"""
   }
   function scrollTopSmooth(){ window.scrollTo({top:0, behavior:'smooth'}); }
 
-  // 価格フィット（保険）
-  function fitPrices(){
-    document.querySelectorAll('#grid .mx').forEach(el=>{
-      const tooWide = el.scrollWidth > el.clientWidth && !el.classList.contains('tiny');
-      el.classList.toggle('shrink', tooWide);
+  // 幅違いサムネ（build の THUMB_WIDTHS）→ srcset。<md5>.webp が最大幅、それ以外は <md5>-<幅>.<ext>
+  const THUMB_WIDTHS = __THUMB_WIDTHS__, THUMB_AVIF = __THUMB_AVIF__;
+  const THUMB_SIZES = '(min-width:1024px) 281px, 25vw';
+  function thumbSrcset(thumb, ext){
+    const stem = thumb.replace(/\.webp$/, ''), maxW = THUMB_WIDTHS[THUMB_WIDTHS.length-1];
+    return THUMB_WIDTHS.map(w => `${stem}${w===maxW?'':'-'+w}.${ext} ${w}w`).join(', ');
+  }
+
+  // 価格フィット（保険）：価格の大きさは描画時に桁数のクラス（m7/shrink/ultra）で決まる。
+  //   6桁以下は base_css の価格幅に必ず収まるので測らない。7桁以上のカードを作ったときだけ、
+  //   rAF でまとめて「全部読む → 全部書く」（読み書きを交互にしてレイアウトを何度も走らせない）
+  const FIT_DIGITS = 7;
+  let fitQueue = [], fitTick = false;
+  const needsFit = i => !Number.isNaN(D.price[i]) && String(Math.trunc(Math.abs(D.price[i]))).length >= FIT_DIGITS;
+  function fitPrices(els){
+    for (const el of els) fitQueue.push(el);
+    if (fitTick || !fitQueue.length) return;
+    fitTick = true;
+    requestAnimationFrame(()=>{
+      fitTick = false;
+      const q = fitQueue.filter(el => el.isConnected); fitQueue = [];
+      const wide = q.map(el => el.scrollWidth > el.clientWidth && !el.classList.contains('tiny'));
+      q.forEach((el, j) => el.classList.toggle('shrink', wide[j]));
     });
   }
+  const fitNew = [];   // この描画で作ったカードのうち測るもの
+  // 幅が変わったら、表示中の測る対象だけ測り直す（使い回しのカードは描画では測らないため）
+  addEventListener('resize', ()=>fitPrices([...grid.querySelectorAll('.mx')].filter(el=>el._fit)));
 
   // --- render ---
-  function render(){
-    const total = VIEW.length;
-    const pages = Math.max(1, Math.ceil(total / PER_PAGE_ADJ));
-    if (page > pages) page = pages;
-    const start = (page - 1) * PER_PAGE_ADJ;
-    const rows  = VIEW.slice(start, start + PER_PAGE_ADJ);
-
-    if (showImages){
-      grid.className = 'grid grid-img';
-
-      grid.innerHTML = rows.map(it=>{
-        const esc = s => (s==null?'':String(s)).replace(/[&<>\"']/g, m=>({"&":"&amp;","<":"&lt;",">":"&gt;","\"":"&quot;","'":"&#39;"}[m]));
-        const nameEsc=esc(it.name||''), codeEsc=esc(it.code||'');
-        const rawPrice = (it.price==null||it.price==='') ? '' : String(parseInt(it.price,10));
-        const priceHtml = rawPrice ? '¥' + parseInt(rawPrice,10).toLocaleString() : '-';
-        const digitCount = rawPrice.replace(/\D/g,'').length;
-
-        let mxClass = 'mx';
-        if (isMobile()) {
-          if (digitCount >= 9)      mxClass += ' ultra';
-          else if (digitCount >= 8) mxClass += ' shrink';
-          else if (digitCount >= 7) mxClass += ' m7';
-        } else {
-          if (digitCount >= 9)      mxClass += ' ultra';
-          else if (digitCount >= 8) mxClass += ' shrink';
-        }
-
-        let thumb=it.thumb||it.image||'';
-        const hasHttp=/^https?:\/\//.test(thumb);
-        if(thumb && !hasHttp && !thumb.startsWith('../')) thumb='../'+thumb;
-
-        return `
+  // カード1枚分の HTML。i はカード番号、sp は SP 表示か（描画ごとに1回だけ判定したもの）
+  //   カードごとに作るのは出力する文字列だけ（エスケープ・価格表示・クラスは共有のものを使う）
+  function imgCardHtml(i, sp){
+    const nameEsc=escHtml(colGet(D.name,i)), codeEsc=escHtml(colGet(D.code,i)), image=colGet(D.image,i), th=colGet(D.thumb,i);
+    const priceHtml=priceLabel(i), price=D.price[i]||0;
+    const mxClass=(sp ? MX_CLASS_SP : MX_CLASS_PC)[Math.min(PRICE_DIGITS[i], 9)];
+
+    let thumb=th||image;
+    const hasHttp=/^https?:\/\//.test(thumb);
+    if(thumb && !hasHttp && !thumb.startsWith('../')) thumb='../'+thumb;
+    const multi = hasBit(D.tv,i)===1 && th && !hasHttp && THUMB_WIDTHS.length>1;
+    const srcsetAttr = multi ? ` data-srcset="${thumbSrcset(thumb,'webp')}" sizes="${THUMB_SIZES}"` : '';
+    const avifSrc = (multi && THUMB_AVIF) ? `<source type="image/avif" data-srcset="${thumbSrcset(thumb,'avif')}" sizes="${THUMB_SIZES}">` : '';
+
+    return `
   <article class="card">
-    <div class="th" data-full="${it.image||''}">
-      <img alt="${nameEsc}" loading="lazy" decoding="async" width="281" height="374" data-src="${thumb}" src=""
-           onerror="this.onerror=null;var p=this.closest('.th');this.src=p?p.getAttribute('data-full'):this.src;">
-    </div>
+    <div class="th" data-full="${image}"><picture>${avifSrc}
+      <img alt="${nameEsc}" loading="lazy" decoding="async" width="281" height="374" data-src="${thumb}"${srcsetAttr} src=""
+           onerror="this.onerror=null;var p=this.closest('.th');if(p){p.querySelectorAll('source').forEach(function(s){s.remove();});this.removeAttribute('srcset');}this.src=p?p.getAttribute('data-full'):this.src;">
+    </picture></div>
     <div class="b">
       <h3 class="n">
         <span class="ttl">${nameEsc}</span>
@@ -1624,137 +3089,239 @@ base_js = r"""
       </h3>
       <div class="foot">
         ${
-          isMobile()
+          sp
           ? `
-            <div class="pricebar"><span class="${mxClass}">${priceHtml||'-'}</span></div>
-            <div class="pricebar"><button class="btn mini btn-add" data-name="${nameEsc}" data-model="${codeEsc}" data-price="${it.price||0}">買取カートへ</button></div>
+            <div class="pricebar"><span class="${mxClass}">${priceHtml}</span></div>
+            <div class="pricebar"><button class="btn mini btn-add" data-name="${nameEsc}" data-model="${codeEsc}" data-price="${price}">買取カートへ</button></div>
           `
           : `
             <div class="pricebar">
-              <span class="${mxClass}">${priceHtml||'-'}</span>
-              <button class="btn mini btn-add" data-name="${nameEsc}" data-model="${codeEsc}" data-price="${it.price||0}">買取カートへ</button>
+              <span class="${mxClass}">${priceHtml}</span>
+              <button class="btn mini btn-add" data-name="${nameEsc}" data-model="${codeEsc}" data-price="${price}">買取カートへ</button>
             </div>
           `
         }
       </div>
     </div>
   </article>`;
-      }).join('');
-    } else {
-      // 画像OFF：必ず grid-list（PC/SPとも同一DOM：.pricecell と .btncell を常に出力）
-      grid.className = 'grid grid-list';
-
-      grid.innerHTML = rows.map(it=>{
-        const esc = s => (s==null?'':String(s)).replace(/[&<>\"']/g, m=>({"&":"&amp;","<":"&lt;",">":"&gt;","\"":"&quot;","'":"&#39;"}[m]));
-        const nameEsc=esc(it.name||''), codeEsc=esc(it.code||'');
-        const rawPrice = (it.price==null||it.price==='') ? '' : String(parseInt(it.price,10));
-        const priceHtml = rawPrice ? '¥' + parseInt(rawPrice,10).toLocaleString() : '-';
-        const digitCount = rawPrice.replace(/\D/g,'').length;
-
-        let mxClass = 'mx';
-        if (isMobile()) {
-          if (digitCount >= 9)      mxClass += ' ultra';
-          else if (digitCount >= 8) mxClass += ' shrink';
-          else if (digitCount >= 7) mxClass += ' m7';
-        } else {
-          if (digitCount >= 9)      mxClass += ' ultra';
-          else if (digitCount >= 8) mxClass += ' shrink';
-        }
-
-        const meta = [it.pack||'', it.booster||''].filter(Boolean).join(' / ');
+  }
+  // 画像OFF：必ず grid-list（PC/SPとも同一DOM：.pricecell と .btncell を常に出力）
+  function listCardHtml(i, sp){
+    const nameEsc=escHtml(colGet(D.name,i)), codeEsc=escHtml(colGet(D.code,i)), pack=colGet(D.pack,i), booster=colGet(D.booster,i);
+    const priceHtml=priceLabel(i), price=D.price[i]||0;
+    const mxClass=(sp ? MX_CLASS_SP : MX_CLASS_PC)[Math.min(PRICE_DIGITS[i], 9)];
+    const meta = pack && booster ? pack + ' / ' + booster : (pack || booster);
 
-        return `
+    return `
     <article class="card">
       <div class="b">
         <h3 class="n">
         <span class="ttl">${nameEsc}</span>
         ${codeEsc ? `<span class="code">${codeEsc}</span>` : ``}
       </h3>
-        <div class="meta">${esc(meta)}</div>
+        <div class="meta">${escHtml(meta)}</div>
         <div class="foot">
-          <div class="pricebar pricecell"><span class="${mxClass}">${priceHtml||'-'}</span></div>
+          <div class="pricebar pricecell"><span class="${mxClass}">${priceHtml}</span></div>
           <div class="btncell">
-            <button class="btn mini btn-add" data-name="${nameEsc}" data-model="${codeEsc}" data-price="${it.price||0}">買取カートへ</button>
+            <button class="btn mini btn-add" data-name="${nameEsc}" data-model="${codeEsc}" data-price="${price}">買取カートへ</button>
           </div>
         </div>
       </div>
     </article>`;
-      }).join('');
+  }
+
+  // カード要素は使い回す。キーはカード番号、表示形（画像あり/なし・SP/PC）が変わったら作り直し
+  //   同じ表示形・同じ番号なら中身も同じなので、残るカードは触らない（画像の読み直しも起きない）
+  const CARD_POOL=new Map(), CARD_POOL_MAX=Math.max(PER_PAGE_ADJ*4, 400);
+  const cardTpl=document.createElement('template');
+  let gridMode='', gridSP=false;
+  //   分割ペイロードの途中は番号が読み込みごとに変わるので、キーは全体の id（片が増えても同じカードは使い回す）
+  function cardNode(i){
+    const g=D.gid ? D.gid[i] : i;
+    let el=CARD_POOL.get(g);
+    if(el){ CARD_POOL.delete(g); CARD_POOL.set(g, el); return el; }   // 最近使った順に並べ直す
+    cardTpl.innerHTML=showImages ? imgCardHtml(i, gridSP) : listCardHtml(i, gridSP);
+    el=cardTpl.content.firstElementChild;
+    CARD_POOL.set(g, el);
+    if(showImages) el.querySelectorAll('img[data-src]').forEach(img=>lazyObserver().observe(img));
+    if(needsFit(i)) el.querySelectorAll('.mx').forEach(mx=>{ mx._fit = true; fitNew.push(mx); });
+    return el;
+  }
+  // 表示していない古いカードから捨てる
+  function trimCardPool(){
+    for(const [i, el] of CARD_POOL){
+      if(CARD_POOL.size<=CARD_POOL_MAX) break;
+      if(el.parentNode===grid) continue;
+      el.querySelectorAll('img[data-src]').forEach(img=>lazyIO?.unobserve(img));
+      CARD_POOL.delete(i);
     }
+  }
 
-    // 画像クリック → ビューア
-    if(showImages){
-      grid.querySelectorAll('.th').forEach(th=>{
-        th.addEventListener('click', (ev)=>{
-          ev.preventDefault(); ev.stopPropagation();
-          document.activeElement?.blur?.();
-          const src = th.getAttribute('data-full') || th.querySelector('img')?.getAttribute('data-src') || th.querySelector('img')?.src || '';
-          if(!src) return;
-          viewerImg.src = src;
-          viewer.classList.add('show');
-          viewer.setAttribute('role','dialog'); viewer.setAttribute('aria-modal','true'); viewer.setAttribute('aria-hidden','false');
-          lockScroll();
-          trapFocus(viewer);
-          (viewerClose || viewer).focus?.({preventScroll:true});
+  // lazy：IntersectionObserver は1つだけ（rootMargin が変わるときだけ作り直し）
+  let lazyIO=null, lazyMargin='';
+  function lazyObserver(){
+    const m=(isMobile()||slowNet)?"300px 0px":"600px 0px";
+    if(!lazyIO || m!==lazyMargin){
+      lazyIO?.disconnect(); lazyMargin=m;
+      lazyIO=new IntersectionObserver((entries)=>{
+        entries.forEach(e=>{
+          if(e.isIntersecting){
+            const img=e.target, ds=img.getAttribute('data-src');
+            if(ds && !img.src){
+              img.parentNode.querySelectorAll('source[data-srcset]').forEach(s=>{ s.srcset=s.getAttribute('data-srcset'); s.removeAttribute('data-srcset'); });
+              const dss=img.getAttribute('data-srcset');
+              if(dss){ img.srcset=dss; img.removeAttribute('data-srcset'); }
+              img.src=ds; img.removeAttribute('data-src');
+            }
+            lazyIO.unobserve(img);
+          }
         });
-      });
+      }, { rootMargin:m, threshold:0.01 });
     }
+    return lazyIO;
+  }
+
+  // 画像クリック → ビューア / カート追加（grid に1回だけ登録）
+  grid.addEventListener('click', (ev)=>{
+    const th=ev.target.closest('.th');
+    if(th){
+      ev.preventDefault(); ev.stopPropagation();
+      document.activeElement?.blur?.();
+      const src = th.getAttribute('data-full') || th.querySelector('img')?.getAttribute('data-src') || th.querySelector('img')?.src || '';
+      if(!src) return;
+      viewerImg.src = src;
+      viewer.classList.add('show');
+      viewer.setAttribute('role','dialog'); viewer.setAttribute('aria-modal','true'); viewer.setAttribute('aria-hidden','false');
+      lockScroll();
+      trapFocus(viewer);
+      (viewerClose || viewer).focus?.({preventScroll:true});
+      return;
+    }
+    const btn=ev.target.closest('.btn-add');
+    if(btn){
+      if (btn._busy) return;
+      btn._busy = true;
+      ev.preventDefault();
+
+      const price = Number(btn.dataset.price)||0;
+      const name  = btn.dataset.name||'';
+      const code  = btn.dataset.model||'';
+
+      const CAP = (typeof NAME_CAP !== 'undefined') ? NAME_CAP : 10;
+      const pairQty = sameSkuTotal(name, code);
+
+      if (pairQty >= CAP) {
+        alert(`${name}［${code}］は合計${CAP}枚までです。`);
+        btn._busy = false;
+        return;
+      }
 
-    // カート追加
-    grid.querySelectorAll('.btn-add').forEach(btn=>{
-      let busy = false;
-      btn.addEventListener('click', (ev)=>{
-        if (busy) return;
-        busy = true;
-        ev.preventDefault();
-
-        const price = Number(btn.dataset.price)||0;
-        const name  = btn.dataset.name||'';
-        const code  = btn.dataset.model||'';
-
-        const CAP = (typeof NAME_CAP !== 'undefined') ? NAME_CAP : 10;
-        const pairQty = sameSkuTotal(name, code);
-
-        if (pairQty >= CAP) {
-          alert(`${name}［${code}］は合計${CAP}枚までです。`);
-          busy = false;
-          return;
-        }
-
-        const f = cart.find(x => (x.name||'')===name && (x.model||'')===code);
-        if (f) { f.qty = (+f.qty||1) + 1; }
-        else   { cart.push({name, model:code, price, qty:1}); }
+      const f = cart.find(x => (x.name||'')===name && (x.model||'')===code);
+      if (f) { f.qty = (+f.qty||1) + 1; }
+      else   { cart.push({name, model:code, price, qty:1}); }
 
-        saveCart();
-        setTimeout(()=> busy = false, 120);
-      }, {passive:false});
+      saveCart();
+      setTimeout(()=> btn._busy = false, 120);
+    }
+  }, {passive:false});
+
+  // 表示形（画像あり/なし・SP/PC）が変わったら grid を空にして作り直す
+  function syncGridMode(){
+    const sp = isMobile(), mode = (showImages ? 'img' : 'list') + (sp ? '-sp' : '-pc');
+    if (mode === gridMode) return false;
+    gridMode = mode; gridSP = sp;
+    grid.className = showImages ? 'grid grid-img' : 'grid grid-list';
+    grid.textContent = '';
+    CARD_POOL.clear(); lazyIO?.disconnect();
+    vs.cols = 0;
+    return true;
+  }
+
+  // ★ 仮想スクロール（VIRTUAL_SCROLL のページ）：ページャの代わりに、見えている行と前後 VS_OVERSCAN 行のカードだけを置く
+  //   上下の見えない行は #grid の padding で高さだけ確保。列数は grid の計算済み列、行の高さは置いたカードの実寸から
+  //   （カード寸法は base_css で固定なので一度測れば足りるが、窓を描き直すたびに1回だけ測り直して誤差をなくす）
+  const VIRTUAL = __VIRTUAL__;
+  const VS_OVERSCAN = 3;
+  const vs = {cols:0, pitch:isMobile() ? 300 : 500, top:0, win:null, tick:false};
+  function vsCols(){
+    syncGridMode();
+    if (!vs.cols) vs.cols = Math.max(1, (getComputedStyle(grid).gridTemplateColumns || '').split(' ').filter(Boolean).length);
+    return vs.cols;
+  }
+  // 今のスクロール位置で置くべき範囲（VIEW 上の位置）
+  function vsWindow(){
+    const cols = vsCols();
+    const y = Math.max(0, (window.pageYOffset || 0) + headerH - vs.top);
+    const first = Math.max(0, Math.floor(y / vs.pitch) - VS_OVERSCAN);
+    const rows = Math.ceil(window.innerHeight / vs.pitch) + VS_OVERSCAN * 2;
+    return vs.win = {from:first * cols, to:(first + rows) * cols};
+  }
+  // 検索し直したら先頭へ（grid より下まで来ているときだけ）
+  function vsToTop(){
+    if ((window.pageYOffset || 0) + headerH > vs.top) window.scrollTo(0, Math.max(0, vs.top - headerH - 8));
+  }
+  // 列数は表示形の切り替え（syncGridMode）や resize で 0 に戻るので、使う側で必ず測り直す
+  function vsPad(){
+    const cols = vsCols();
+    const first = Math.floor(winFrom / cols), rows = Math.ceil(pageIds.length / cols);
+    const rest = Math.max(0, Math.ceil(hitTotal / cols) - first - rows);
+    grid.style.paddingTop = (first * vs.pitch) + 'px';
+    grid.style.paddingBottom = (rest * vs.pitch) + 'px';
+    return first * vs.pitch + rest * vs.pitch;
+  }
+  function vsLayout(){
+    const fresh = !vs.cols, pad = vsPad();
+    if (!pageIds.length) return;
+    // 置いた行の実寸から1行の高さ（行間込み）を測り直す
+    const rect = grid.getBoundingClientRect(), gap = parseFloat(getComputedStyle(grid).rowGap) || 0;
+    const rows = Math.ceil(pageIds.length / vs.cols);
+    const pitch = (rect.height - pad + gap) / rows;
+    vs.top = rect.top + (window.pageYOffset || 0);
+    if (pitch > 0 && Math.abs(pitch - vs.pitch) > 0.5){ vs.pitch = pitch; vsPad(); vsOnScroll(); }
+    // 列数を測り直した（画像あり/なし の切り替えなど）なら、前の列数で切った窓を置き直す
+    else if (fresh) vsOnScroll();
+  }
+  function vsOnScroll(){
+    if (vs.tick) return;
+    vs.tick = true;
+    requestAnimationFrame(()=>{
+      vs.tick = false;
+      const w = vs.win, cols = vs.cols;
+      const n = vsWindow();
+      if (!w || n.from !== w.from || n.to !== w.to || cols !== vs.cols) request(n);
     });
+  }
+  if (VIRTUAL){
+    navs.forEach(n=>{ n.hidden = true; });
+    addEventListener('scroll', vsOnScroll, {passive:true});
+    addEventListener('resize', ()=>{ vs.cols = 0; vs.win = null; vsOnScroll(); });
+  }
+
+  function render(){
+    syncGridMode();
+    // 並び替え：先頭から順に、違うカードのところへ差し込む。残りは外す
+    let ref = grid.firstChild;
+    for (let j = 0; j < pageIds.length; j++){
+      const el = cardNode(pageIds[j]);
+      if (el === ref) ref = ref.nextSibling;
+      else grid.insertBefore(el, ref);
+    }
+    while (ref){ const nx = ref.nextSibling; grid.removeChild(ref); ref = nx; }
+    trimCardPool();
+
+    fitPrices(fitNew.splice(0));
+    if (VIRTUAL){ vsLayout(); return; }
 
     // ページャ
+    const pages = Math.max(1, Math.ceil(hitTotal / PER_PAGE_ADJ));
     const pagerHtml=renderPager(page, pages);
     navs.forEach(n=>{
       n.innerHTML=pagerHtml;
       n.onclick=(e)=>{
         const a=e.target.closest('a,button'); if(!a || a.matches('.disabled,[disabled]')) return; e.preventDefault();
-        const p=parseInt(a.dataset.page||'0',10); if(p && p!==page){ page=p; render(); scrollTopSmooth(); }
+        const p=parseInt(a.dataset.page||'0',10); if(p && p!==page){ goPage(p); scrollTopSmooth(); }
       };
     });
-
-    // lazy
-    if(showImages){
-      const io=new IntersectionObserver((entries)=>{
-        entries.forEach(e=>{
-          if(e.isIntersecting){
-            const img=e.target, ds=img.getAttribute('data-src');
-            if(ds && !img.src){ img.src=ds; img.removeAttribute('data-src'); }
-            io.unobserve(img);
-          }
-        });
-      }, { rootMargin:(isMobile()||slowNet)?"300px 0px":"600px 0px", threshold:0.01 });
-      document.querySelectorAll('#grid img[data-src]').forEach(img=>io.observe(img));
-    }
-
-    fitPrices();
   }
   // --- render end ---
 
@@ -1850,12 +3417,23 @@ base_js = r"""
   const DEBOUNCE=(isMobile()||slowNet||cores<=4)?240:120;
   function onInputDebounced(el){ el.addEventListener('input', ()=>{ clearTimeout(el._t); el._t=setTimeout(apply,DEBOUNCE); }); }
   [nameQ,codeQ,packQ,rarityQ].forEach(onInputDebounced);
+  [priceMin,priceMax].forEach(el=>{ if(el) onInputDebounced(el); });
+  [fxRarity,fxPack].forEach(box=>box?.addEventListener('change', apply));
+  fxClear?.addEventListener('click', ()=>{
+    [priceMin,priceMax].forEach(el=>{ if(el) el.value=''; });
+    [fxRarity,fxPack].forEach(box=>box?.querySelectorAll('input:checked').forEach(x=>{ x.checked=false; }));
+    apply();
+  });
 
   function initButtons(){
     btnLatest?.addEventListener('click', ()=>{ latestOnly = !latestOnly; setLatestBtn(); apply(); });
     setLatestBtn();
 
     btnPromo?.addEventListener('click', ()=>{ promoOnly = !promoOnly; setPromoBtn(); apply(); }); setPromoBtn();
+    btnChanged?.addEventListener('click', ()=>{
+      changedOnly = !changedOnly; setChangedBtn();
+      if(changedOnly && !changedIds) loadChanges().then(()=>{ if(changedOnly) apply(); }); else apply();
+    });
     btnDesc?.addEventListener('click', ()=>{ currentSort=(currentSort==='desc')?null:'desc'; setActiveSort(); apply(); });
     btnAsc ?.addEventListener('click', ()=>{ currentSort=(currentSort==='asc' )?null:'asc' ; setActiveSort(); apply(); });
     btnNone?.addEventListener('click', ()=>{ currentSort=null; setActiveSort(); apply(); });
@@ -1863,7 +3441,10 @@ base_js = r"""
   }
 
   setActiveSort(); initButtons(); loadCart(); apply();
-})();
+  if(SHARDS) (window.requestIdleCallback || setTimeout)(()=>{
+    addShards(SHARDS.s.map((_,j)=>j));
+  });
+});
 
 // ダブルタップでのズームを全体で抑止（ボタン類のみ）
 document.addEventListener('dblclick', (e)=>{
@@ -1874,6 +3455,23 @@ document.addEventListener('dblclick', (e)=>{
 """
 
 # ===== HTML =====
+def facets_html(facets: dict) -> str:
+    # 詳細検索パネル。チェックボックスの value はブラウザ側の絞り込みキー、表示は代表の表記と件数
+    def box(fid, legend, rows):
+        items = "".join(
+            f"<label><input type='checkbox' value='{html_mod.escape(v)}'>{html_mod.escape(label)}<small>({n:,})</small></label>"
+            for v, label, n in rows)
+        return f"<fieldset id='{fid}'><legend>{legend}</legend><div class='fx-list'>{items}</div></fieldset>"
+    return ("  <details class='facets'><summary>詳細検索（価格帯・レアリティ・弾）</summary>"
+            "<div class='fx-price'>"
+            "<input id='priceMin' class='search' type='number' inputmode='numeric' min='0' step='1' placeholder='買取価格 下限（円）'>"
+            "<span>〜</span>"
+            "<input id='priceMax' class='search' type='number' inputmode='numeric' min='0' step='1' placeholder='買取価格 上限（円）'>"
+            "</div>"
+            + box("fxRarity", "レアリティ", facets.get("rarity", []))
+            + box("fxPack", "弾", facets.get("pack", []))
+            + "<button id='fxClear' class='btn' type='button'>条件をクリア</button></details>")
+
 def html_page(title: str, js_source: str, logo_uri: str, cards_json: str, updated_text: str = "") -> str:
     shop_svg   = "<svg viewBox='0 0 24 24' aria-hidden='true' fill='currentColor'><path d='M3 9.5V8l2.2-3.6c.3-.5.6-.7 1-.7h11.6c.4 0 .7.2 .9 .6L21 8v1.5c0 1-.8 1.8-1.8 1.8-.9 0-1.6-.6-1.8-1.4-.2 .8-.9 1.4-1.8 1.4s-1.6-.6-1.8-1.4c-.2 .8-.9 1.4-1.8 1.4C3.8 11.3 3 10.5 3 9.5zM5 12.5h14V20c0 .6-.4 1-1 1H6c-.6 0-1-.4-1-1v-7.5zm4 1.5v5h6v-5H9zM6.3 5.2 5 7.5h14l-1.3-2.3H6.3z'/></svg>"
     takuhai_svg= "<svg viewBox='0 0 24 24' aria-hidden='true' fill='currentColor'><path d='M3 6h11a2 2 0 0 1 2 2v1h3l2 3v5a2 2 0 0 1-2 2h-1a2 2 0 0 1-2-2H8a2 2 0 0 1-2 2H4a2 2 0 0 1-2-2V8a2 2 0 0 1 2-2Zm0 2v9h2a2 2 0 0 1 2-2h8V8H3Zm16 3h-2v4h4v-3.2L19 11Z'/></svg>"
@@ -1881,7 +3479,14 @@ def html_page(title: str, js_source: str, logo_uri: str, cards_json: str, update
     parts.append("<!doctype html><html lang='ja'><head><meta charset='utf-8'>")
     parts.append("<meta name='viewport' content='width=device-width,initial-scale=1'>")
     parts.append(f"<meta name='cards-ver' content='{CARDS_VER}'>")
-    parts.append("<style>"); parts.append(base_css); parts.append("</style>")
+    if CHANGES_JSON:
+        parts.append(f"<meta name='changes-ver' content='{CHANGES_VER}'>")
+    if CARDS_MODE == "external":
+        parts.append(f"<link rel='preload' href='../{data_asset('cards', CARDS_VER)}' as='fetch' crossorigin>")
+    shards = json.loads(CARDS_JSON)["s"] if CARDS_MODE == "shards" else []
+    if shards:
+        parts.append(f"<link rel='preload' href='../{data_asset('shard', shards[0]['v'])}' as='fetch' crossorigin>")
+    parts.append("<style>"); parts.append(PAGE_CSS); parts.append("</style>")
     parts.append("<script src='https://static.line-scdn.net/liff/edge/2/sdk.js' data-liff></script>")
     parts.append("</head><body>")
 
@@ -1970,8 +3575,13 @@ def html_page(title: str, js_source: str, logo_uri: str, cards_json: str, update
     parts.append("    <button id='btnPromo'     class='btn' type='button' aria-pressed='false'>強化買取中!!</button>")
     parts.append("    <button id='btnPriceDesc' class='btn' type='button' aria-pressed='false'>価格高い順</button>")
     parts.append("    <button id='btnPriceAsc'  class='btn' type='button' aria-pressed='false'>価格低い順</button>")
+    if CHANGES_JSON:
+        parts.append(f"    <button id='btnChanged' class='btn' type='button' aria-pressed='false'>価格変動（{CHANGES_COUNT:,}）</button>")
     parts.append("    <button id='btnToggleImages' class='btn' type='button'>画像ON</button>")
-    parts.append("  </div></div>")
+    parts.append("  </div>")
+    if FACET_VALUES:
+        parts.append(facets_html(FACET_VALUES))
+    parts.append("</div>")
     parts.append("  <nav class='simple'></nav><div id='grid' class='grid grid-img'></div><nav class='simple'></nav>")
     parts.append("  <small class='note'>画像クリックで拡大。🛒カートから「LINEに送る」でCLIMAX公式LINEへ送信できます（アプリ外でもOK）。</small>")
     parts.append("</main>")
@@ -1980,7 +3590,33 @@ def html_page(title: str, js_source: str, logo_uri: str, cards_json: str, update
     parts.append("<div id='viewer' class='viewer' tabindex='-1' aria-hidden='true'><div class='vc'><img id='viewerImg' alt='' role='img'><button id='viewerClose' class='close' aria-label='閉じる'>×</button></div></div>")
 
     # data
-    parts.append("<script>window.__CARDS__=" + cards_json + ";</script>")
+    if CARDS_MODE == "shards":
+        # 目録は埋め込み、先頭の片だけ読んでから起動（残りの片はページ側が裏で読む）
+        v = shards[0]["v"] if shards else ""
+        cards_js = (f"window.__SHARDS__={CARDS_JSON};"
+                    + (f"window.__CARDS_READY__=L('../{data_asset('shard', v)}','__SHARD_{v}__')" if v else
+                       "window.__CARDS_READY__=Promise.resolve()")
+                    + ".then(function(){var p=window.__SHARD_" + v + "__;"
+                    "window.__CARDS__={fmt:'shards',n:window.__SHARDS__.n,parts:p?[p]:[]};});")
+    else:
+        cards_js = f"window.__CARDS_READY__=L('../{data_asset('cards', CARDS_VER)}','__CARDS__');"
+    if CARDS_MODE in ("external", "shards"):
+        # fetch が使えない file:// や失敗時は同じ版の .js（window.<名前> 代入）を script で読む
+        parts.append(
+            "<script>(function(){"
+            "function L(u,k){"
+            "function viaScript(){return new Promise(function(r){var s=document.createElement('script');"
+            "s.src=u.replace(/\\.json$/,'.js');s.onload=s.onerror=function(){r();};document.head.appendChild(s);});}"
+            "if(location.protocol==='file:'||!window.fetch) return viaScript();"
+            "return fetch(u,{credentials:'same-origin'}).then(function(r){if(!r.ok) throw r.status;return r.json();})"
+            ".then(function(d){window[k]=d;}).catch(viaScript);}"
+            + cards_js
+            + (f"window.__SEARCH_READY__=L('../{data_asset('search', SEARCH_VER)}','__SEARCH_IDX__');" if SEARCH_JSON else "")
+            + "})();</script>"
+        )
+    else:
+        parts.append("<script>window.__CARDS__=" + cards_json + ";</script>")
+        if SEARCH_JSON: parts.append("<script>window.__SEARCH_IDX__=" + SEARCH_JSON + ";</script>")
     # cart modal  ← 関数内にインデント
     parts.append(
     "<div id='cartModal' class='cart-modal' tabindex='-1' role='dialog' aria-modal='true' aria-hidden='true' aria-label='仮査定カート'>"
@@ -2009,34 +3645,367 @@ def html_page(title: str, js_source: str, logo_uri: str, cards_json: str, update
     return "".join(parts)
 
 
+# ===== 最小化・事前圧縮 =====
+MINIFY      = os.getenv("MINIFY", "1") == "1"        # CSS/JS のコメント・空白を落とす
+PRECOMPRESS = os.getenv("PRECOMPRESS", "1") == "1"   # HTML/JSON/CSS/JS に .gz / .br を並べて出す
+GZIP_LEVEL     = int(os.getenv("GZIP_LEVEL", "9"))         # --watch 中は WATCH_GZIP_LEVEL
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "11"))   # --watch 中は WATCH_BROTLI_QUALITY
+COMPRESSIBLE = {".html", ".json", ".css", ".js"}
+
+CSS_TOKEN_RE = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|/\*.*?\*/|\s+|[^"\'/\s]+|/', re.S)
+
+def minify_css(src: str) -> str:
+    # 文字列は保持、コメント削除、空白は1個に。{};,> の前後と : の後ろの空白は不要
+    # （: の前は「.a :hover」の子孫指定があり得るので残す）
+    out = []
+    for t in CSS_TOKEN_RE.findall(src):
+        if t.startswith("/*"): continue
+        out.append(" " if t.isspace() else t)
+    css = "".join(out)
+    css = re.sub(r" ?([{};,>]) ?", r"\1", css)
+    css = re.sub(r": ", ":", css)
+    return css.replace(";}", "}").strip()
+
+JS_WORD = re.compile(r"[A-Za-z0-9_$\\\u0080-\uffff]")
+JS_REGEX_AFTER = set("(,=:[!&|?{};+-*%<>~^") | {""}
+JS_REGEX_KW = {"return", "typeof", "instanceof", "in", "of", "new", "delete", "void", "throw", "case", "do", "else", "yield", "await"}
+
+def minify_js(src: str) -> str:
+    # 安全側の最小化：コメント削除と空白の詰めのみ（識別子・演算子は触らない）
+    # 改行は ASI に効くので、前後どちらかが明らかに文の途中/区切りのときだけ落とす
+    out: List[str] = []
+    n = len(src); i = 0
+    last = ""             # 直前の有意トークン（正規表現リテラルか除算かの判定用）
+    brace = 0; tmpl = []  # テンプレートリテラル内 ${ } の入れ子
+    pending = ""          # 保留中の空白（"" / " " / "\n"）
+
+    def emit(tok: str):
+        nonlocal pending
+        if pending and out:
+            a, b = out[-1][-1], tok[0]
+            if pending == "\n" and (a in "{;,([" or b in ")]},;:."):
+                pending = " "
+            if pending == " ":
+                keep = (JS_WORD.match(a) and JS_WORD.match(b)) or (a in "+-" and b in "+-") \
+                       or (a == "/" and b in "/*") or (a.isdigit() and b == ".")
+                pending = " " if keep else ""
+            out.append(pending)
+        pending = ""
+        out.append(tok)
+
+    while i < n:
+        c = src[i]
+        if c.isspace():
+            j = i
+            while j < n and src[j].isspace(): j += 1
+            if "\n" in src[i:j]: pending = "\n"
+            elif not pending: pending = " "
+            i = j; continue
+        if c == "/" and src.startswith("//", i):
+            j = src.find("\n", i); i = n if j < 0 else j; continue
+        if c == "/" and src.startswith("/*", i):
+            j = src.find("*/", i + 2); j = n if j < 0 else j + 2
+            if "\n" in src[i:j]: pending = "\n"
+            elif not pending: pending = " "
+            i = j; continue
+        if c in "'\"":
+            j = i + 1
+            while j < n and src[j] != c and src[j] != "\n":
+                j += 2 if src[j] == "\\" else 1
+            emit(src[i:j + 1]); last = '"'; i = j + 1; continue
+        if c == "`" or (c == "}" and tmpl and tmpl[-1] == brace):
+            if c == "}": tmpl.pop()
+            j = i + 1; opened = False
+            while j < n:
+                if src[j] == "\\": j += 2; continue
+                if src[j] == "`": j += 1; break
+                if src.startswith("${", j): j += 2; tmpl.append(brace); opened = True; break
+                j += 1
+            emit(src[i:j]); last = "(" if opened else '"'; i = j; continue
+        if c == "/" and (last in JS_REGEX_AFTER or last in JS_REGEX_KW):
+            j = i + 1; cls = False
+            while j < n and (cls or src[j] != "/") and src[j] != "\n":
+                if src[j] == "\\": j += 1
+                elif src[j] == "[": cls = True
+                elif src[j] == "]": cls = False
+                j += 1
+            j += 1
+            while j < n and src[j].isalpha(): j += 1
+            emit(src[i:j]); last = '"'; i = j; continue
+        if JS_WORD.match(c):
+            j = i + 1
+            while j < n and JS_WORD.match(src[j]): j += 1
+            emit(src[i:j]); last = src[i:j]; i = j; continue
+        if c == "{": brace += 1
+        elif c == "}": brace -= 1
+        emit(c); last = c; i += 1
+    return "".join(out).strip()
+
+def _gzip(b: bytes) -> bytes: return gzip.compress(b, GZIP_LEVEL, mtime=0)
+def _brotli(b: bytes) -> bytes: return brotli.compress(b, quality=BROTLI_QUALITY)
+
+PAGE_CSS = PAGE_JS = ""
+
+def build_assets(df: pd.DataFrame):
+    global PAGE_CSS, PAGE_JS
+    if PARITY_CHECK and not check_search_key_parity(base_js, df):
+        sys.exit("[PARITY] ビルド側の検索キーが base_js の正規化と一致しません")
+    PAGE_CSS = minify_css(base_css) if MINIFY else base_css
+    PAGE_JS  = minify_js(base_js) if MINIFY else base_js
+
 # ===== 出力 =====
-OUT_DIR.mkdir(parents=True, exist_ok=True)
+INCREMENTAL = os.getenv("INCREMENTAL", "1") == "1"   # 1 なら中身が同じ出力は書き換えない
+WRITE_STATS = {"written": 0, "skipped": 0}
+SIZE_REPORT = []   # (OUT_DIR からの相対パス, 最小化前, 最小化後, gzip, brotli)
+# .gz / .br をどの設定で作ったか（"gzip9" / "br11"）。設定が変わったら（--watch の後の通常ビルドなど）本体が同じでも作り直す
+PRECOMP_MANIFEST = OUT_DIR / "assets" / "precompress.manifest.json"
+PRECOMP_PREV, PRECOMP_SEEN = {}, {}
+
+def load_precomp_manifest() -> dict:
+    try:
+        m = json.loads(PRECOMP_MANIFEST.read_text(encoding="utf-8"))
+        return m if isinstance(m, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+def save_precomp_manifest():
+    # 今回 write_output を通った兄弟だけ残す（掃除済みの古い版は載せない）
+    if PRECOMP_SEEN == PRECOMP_PREV: return
+    PRECOMP_MANIFEST.parent.mkdir(parents=True, exist_ok=True)
+    tmp = PRECOMP_MANIFEST.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(PRECOMP_SEEN, sort_keys=True, separators=(",", ":")), encoding="utf-8")
+    os.replace(tmp, PRECOMP_MANIFEST)
+
+def write_output(path: Path, data, raw_size: Optional[int] = None) -> bool:
+    # 圧縮対象なら .gz / .br も。本体が変わっていない・兄弟が揃っているなら圧縮自体を省く
+    # 作らない兄弟（PRECOMPRESS=0 / brotli なし）は、本体を書き直したら消す（古い中身が配信されないように）
+    body = data.encode("utf-8") if isinstance(data, str) else data
+    changed = _write_file(path, body)
+    compress = PRECOMPRESS and path.suffix in COMPRESSIBLE
+    sizes = {}
+    for ext, fn, tag in [(".gz", _gzip, f"gzip{GZIP_LEVEL}"), (".br", _brotli if brotli else None, f"br{BROTLI_QUALITY}")]:
+        sib = path.with_name(path.name + ext)
+        if not compress or fn is None:
+            if changed and sib.exists(): sib.unlink()
+            continue
+        key = sib.relative_to(OUT_DIR).as_posix()
+        if changed or not sib.exists() or PRECOMP_PREV.get(key) != tag: _write_file(sib, fn(body))
+        PRECOMP_SEEN[key] = tag
+        sizes[ext] = sib.stat().st_size
+    if not compress: return changed
+    SIZE_REPORT.append((path.relative_to(OUT_DIR).as_posix(), raw_size or len(body), len(body),
+                        sizes.get(".gz"), sizes.get(".br")))
+    return changed
+
+def _write_file(path: Path, body: bytes) -> bool:
+    # 一時ファイル → rename で原子的に書く。INCREMENTAL 時はディスク上と同じハッシュなら書かない
+    if INCREMENTAL:
+        try:
+            if path.stat().st_size == len(body) and \
+               hashlib.sha256(path.read_bytes()).digest() == hashlib.sha256(body).digest():
+                WRITE_STATS["skipped"] += 1
+                return False
+        except OSError:
+            pass
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp, "wb") as f: f.write(body)
+        os.replace(tmp, path)
+    finally:
+        if tmp.exists(): tmp.unlink()
+    WRITE_STATS["written"] += 1
+    return True
 
 def write_mode(dir_name: str, initial_sort_js_literal: str, title_text: str):
     sub = OUT_DIR / dir_name
-    sub.mkdir(parents=True, exist_ok=True)
-    js = (base_js
+    js = (PAGE_JS
           .replace("__PER_PAGE__", str(PER_PAGE))
           .replace("__INITIAL_SORT__", initial_sort_js_literal)
           .replace("__LIFF_ID__", LIFF_ID)
-          .replace("__OA_ID__", OA_ID))
+          .replace("__OA_ID__", OA_ID)
+          .replace("__THUMB_WIDTHS__", json.dumps(THUMB_WIDTHS))
+          .replace("__THUMB_AVIF__", "true" if THUMB_AVIF else "false")
+          .replace("__SEARCH_WORKER__", json.dumps(SEARCH_WORKER))
+          .replace("__SHARD_URL__", json.dumps("../" + data_asset("shard", "*")))
+          .replace("__CHANGES_URL__", json.dumps("../" + data_asset("changes", CHANGES_VER) if CHANGES_JSON else ""))
+          .replace("__VIRTUAL__", "true" if dir_name in VIRTUAL_SCROLL or "all" in VIRTUAL_SCROLL else "false"))
     html = html_page(title_text, js, LOGO_URI, CARDS_JSON, UPDATED_LABEL)
-    (sub/"index.html").write_text(html, encoding="utf-8")
-
-write_mode("default", "'desc'", "ワンピ買取表")
-write_mode("price_desc", "'desc'", "ワンピ買取表（price_desc）")
-write_mode("price_asc",  "'asc'",  "ワンピ買取表（price_asc）")
-
-(OUT_DIR/"index.html").write_text("<meta http-equiv='refresh' content='0; url=default/'>", encoding="utf-8")
-
-print(f"[*] Excel/CSV: {EXCEL_PATH!r}")
-print(f"[*] PER_PAGE={PER_PAGE}  BUILD_THUMBS={'1' if BUILD_THUMBS else '0'}")
-
-print(f"[LOGO]  {'embedded from ' + str(LOGO_PATH)       if LOGO_URI        else 'not found (fallback text used)'}")
-print(f"[X]     {'embedded from ' + str(X_ICON_PATH)     if X_ICON_URI      else 'not found'}")
-print(f"[LINE]  {'embedded from ' + str(LINE_ICON_PATH)  if LINE_ICON_URI   else 'not found'}")
-print(f"[IG]    {'embedded from ' + str(INSTAGRAM_ICON_PATH) if INSTAGRAM_ICON_URI else 'not found'}")
-print(f"[TT]    {'embedded from ' + str(TIKTOK_ICON_PATH)    if TIKTOK_ICON_URI    else 'not found'}")
+    raw_size = len(html.encode("utf-8")) + len((base_css + base_js).encode("utf-8")) - len((PAGE_CSS + PAGE_JS).encode("utf-8"))
+    write_output(sub/"index.html", html, raw_size)
+    if SITE_ASSETS:
+        size = len(html.encode("utf-8"))
+        print(f"[ASSET] {dir_name}/index.html {size/1024:.1f}KB（ロゴ/アイコン外部化で -{IMAGE_SAVINGS[0]/1024:.1f}KB）")
+
+def write_data_asset(kind: str, ver: str, body: str, global_name: str):
+    # 内容ハッシュ名なので一度出した版は不変。最新 CARDS_KEEP 版以外を掃除
+    write_output(OUT_DIR / data_asset(kind, ver), body)
+    write_output(OUT_DIR / data_asset(kind, ver, "js"), f"window.{global_name}=" + body + ";")
+    vers = {}
+    for f in (OUT_DIR / "assets").glob(f"{kind}.*.*"):
+        m = re.fullmatch(re.escape(kind) + r"\.([0-9a-f]{8})\.(json|js)(\.gz|\.br)?", f.name)
+        if m: vers.setdefault(m.group(1), []).append(f)
+    old = sorted((v for v in vers if v != ver),
+                 key=lambda v: max(f.stat().st_mtime for f in vers[v]), reverse=True)[CARDS_KEEP - 1:]
+    for v in old:
+        for f in vers[v]: f.unlink()
+
+def write_shards():
+    # 片も内容ハッシュ名。残っている目録（最新 CARDS_KEEP 版）のどれからも参照されない片を掃除
+    for v, body in CARDS_SHARDS.items():
+        write_output(OUT_DIR / data_asset("shard", v), body)
+        write_output(OUT_DIR / data_asset("shard", v, "js"), f"window.__SHARD_{v}__=" + body + ";")
+    keep = set(CARDS_SHARDS)
+    for f in (OUT_DIR / "assets").glob("cards.*.json"):
+        try:
+            m = json.loads(f.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            continue
+        if isinstance(m, dict) and m.get("fmt") == "shards": keep |= {e["v"] for e in m["s"]}
+    for f in (OUT_DIR / "assets").glob("shard.*.*"):
+        m = re.fullmatch(r"shard\.([0-9a-f]{8})\.(json|js)(\.gz|\.br)?", f.name)
+        if m and m.group(1) not in keep: f.unlink()
+
+def write_site():
+    OUT_DIR.mkdir(parents=True, exist_ok=True)
+    WRITE_STATS.update(written=0, skipped=0); SIZE_REPORT.clear()
+    PRECOMP_PREV.clear(); PRECOMP_PREV.update(load_precomp_manifest()); PRECOMP_SEEN.clear()
+    if CARDS_MODE in ("external", "shards"):
+        write_data_asset("cards", CARDS_VER, CARDS_JSON, "__CARDS__")
+        if CARDS_SHARDS: write_shards()
+        if SEARCH_JSON: write_data_asset("search", SEARCH_VER, SEARCH_JSON, "__SEARCH_IDX__")
+    if CHANGES_JSON: write_data_asset("changes", CHANGES_VER, CHANGES_JSON, "__CHANGES__")
+    for rel, data in SITE_ASSETS.items(): write_output(OUT_DIR / rel, data)
+    write_mode("default", "'desc'", "ワンピ買取表")
+    write_mode("price_desc", "'desc'", "ワンピ買取表（price_desc）")
+    write_mode("price_asc",  "'asc'",  "ワンピ買取表（price_asc）")
+
+    write_output(OUT_DIR/"index.html", "<meta http-equiv='refresh' content='0; url=default/'>")
+    save_precomp_manifest()
+    print(f"[WRITE] 書込{WRITE_STATS['written']} / 変更なしスキップ{WRITE_STATS['skipped']}")
+    if SIZE_REPORT:
+        kb = lambda v: f"{v/1024:9.1f}" if v is not None else f"{'-':>9s}"
+        print(f"[SIZE] {'file':40s} {'raw KB':>9s} {'min KB':>9s} {'gzip KB':>9s} {'br KB':>9s}")
+        for name, raw, mn, gz, br in SIZE_REPORT:
+            print(f"[SIZE] {name:40s} {kb(raw)} {kb(mn)} {kb(gz)} {kb(br)}")
+        if brotli is None: print("[SIZE] brotli 未インストールのため .br は出力していません（pip install brotli）")
+
+def _img_label(uri: str, path, missing: str = "not found") -> str:
+    if not uri: return missing
+    return ("embedded from " if uri.startswith("data:") else f"asset {uri} from ") + str(path)
+
+# ===== 実行 =====
+def _stage(times: List[str], name: str, fn, *args):
+    # 段階ごとの所要時間を times に積む（[TIME] 行用）
+    t0 = time.perf_counter()
+    out = fn(*args)
+    times.append(f"{name} {(time.perf_counter() - t0) * 1000:.0f}ms")
+    return out
+
+def build(excel_path: str = EXCEL_PATH) -> pd.DataFrame:
+    # 起動 → 最初の段階（import と設定の読み込み）と、段階ごとの所要時間を [TIME] に出す
+    global UPDATED_LABEL
+    print(f"[TIME] 起動 → 最初の段階 {(time.perf_counter() - _T_START) * 1000:.0f}ms")
+    times = []
+    _stage(times, "icons", load_icons)
+    df = _stage(times, "input", load_df, excel_path)
+    UPDATED_LABEL = updated_label(excel_path)
+    _stage(times, "thumbs", add_thumbs, df)
+    _stage(times, "data", build_data, df)
+    _stage(times, "changes", build_changes)
+    _stage(times, "history", record_history)
+    _stage(times, "assets", build_assets, df)
+    _stage(times, "write", write_site)
+
+    print(f"[*] Excel/CSV: {excel_path!r}")
+    print(f"[*] PER_PAGE={PER_PAGE}  BUILD_THUMBS={'1' if BUILD_THUMBS else '0'}")
+    print(f"[LOGO]  {_img_label(LOGO_URI, LOGO_PATH, 'not found (fallback text used)')}")
+    print(f"[X]     {_img_label(X_ICON_URI, X_ICON_PATH)}")
+    print(f"[LINE]  {_img_label(LINE_ICON_URI, LINE_ICON_PATH)}")
+    print(f"[IG]    {_img_label(INSTAGRAM_ICON_URI, INSTAGRAM_ICON_PATH)}")
+    print(f"[TT]    {_img_label(TIKTOK_ICON_URI, TIKTOK_ICON_PATH)}")
+    print(f"[TIME] {' / '.join(times)}")
+    print(f"[OK] 生成完了 → {OUT_DIR.resolve()} / 総件数{len(df)}")
+    return df
+
+# ===== 監視モード（--watch） =====
+# 入力ファイルを定期的に stat し、保存が落ち着いたら（WATCH_DEBOUNCE 秒変化なし）入力以降の段階だけやり直す。
+# ロゴ/アイコン・最小化済み CSS/JS は最初のビルドのものを使い続ける
+WATCH_INTERVAL = float(os.getenv("WATCH_INTERVAL", "0.1"))    # stat する間隔（秒）
+WATCH_DEBOUNCE = float(os.getenv("WATCH_DEBOUNCE", "0.25"))   # 連続保存をまとめる待ち時間（秒）
+# 監視中の .gz / .br は速さ優先（gzip 9 / brotli 11 は数MBのペイロードで1ファイル数秒）。配信用は通常のビルドで
+# （作った設定は precompress.manifest.json に残るので、通常のビルドが本体の変わっていない兄弟も作り直す）
+WATCH_GZIP_LEVEL = int(os.getenv("WATCH_GZIP_LEVEL", "1"))
+WATCH_BROTLI_QUALITY = int(os.getenv("WATCH_BROTLI_QUALITY", "4"))
+
+def _input_stamp(path_hint: str):
+    # (解決後のパス, 更新時刻ns, サイズ)。見つからない・保存途中で読めないときは None
+    try:
+        p = _resolve_input(path_hint); st = p.stat()
+        return p, st.st_mtime_ns, st.st_size
+    except OSError:
+        return None
 
-print(f"[OK] 生成完了 → {OUT_DIR.resolve()} / 総件数{len(df)}")
+def rebuild(excel_path: str, prev: Optional[pd.DataFrame]) -> pd.DataFrame:
+    # 入力を読み直し、中身が前回と同じ（保存し直しただけ）ならペイロード・索引は作り直さない
+    # prev は前回の df（サムネ・検索キーの列が足されているので、読込時の列だけで比べる）
+    global UPDATED_LABEL
+    times = []
+    df = _stage(times, "input", load_df, excel_path)
+    UPDATED_LABEL = updated_label(excel_path)
+    cols = list(df.columns)
+    if prev is not None and set(cols) <= set(prev.columns) and df.equals(prev[cols]):
+        df = prev
+    else:
+        _stage(times, "thumbs", add_thumbs, df)
+        _stage(times, "data", build_data, df)
+        _stage(times, "changes", build_changes)
+        _stage(times, "history", record_history)
+    _stage(times, "write", write_site)
+    print(f"[TIME] {' / '.join(times)}")
+    return df
+
+def watch(excel_path: str = EXCEL_PATH):
+    global GZIP_LEVEL, BROTLI_QUALITY
+    GZIP_LEVEL, BROTLI_QUALITY = WATCH_GZIP_LEVEL, WATCH_BROTLI_QUALITY
+    seen = _input_stamp(excel_path)
+    prev = build(excel_path)
+    print(f"[WATCH] {seen[0] if seen else excel_path} を監視中（{WATCH_INTERVAL}s 間隔 / Ctrl+C で終了）")
+    try:
+        while True:
+            time.sleep(WATCH_INTERVAL)
+            cur = _input_stamp(excel_path)
+            if cur is None or cur == seen: continue
+            # 保存中は更新時刻・サイズが動くので、WATCH_DEBOUNCE 秒変わらなくなるまで待つ
+            quiet = time.perf_counter()
+            while time.perf_counter() - quiet < WATCH_DEBOUNCE:
+                time.sleep(WATCH_INTERVAL)
+                nxt = _input_stamp(excel_path)
+                if nxt != cur: cur, quiet = nxt, time.perf_counter()
+            if cur is None or cur == seen: continue
+            seen = cur
+            t0 = time.perf_counter()
+            try:
+                prev = rebuild(excel_path, prev)
+            except Exception as e:   # 保存途中のファイルを掴んだ等。出力は前回のまま、次の保存で再試行
+                print(f"[WATCH] 再ビルド失敗: {e!r}")
+                continue
+            print(f"[WATCH] 再ビルド {(time.perf_counter() - t0) * 1000:.0f}ms"
+                  f"（保存から {(time.time() - cur[1] / 1e9) * 1000:.0f}ms） {UPDATED_LABEL}")
+    except KeyboardInterrupt:
+        print("[WATCH] 終了")
+
+def main(argv: Optional[List[str]] = None):
+    # 引数: [入力ファイル（省略時は EXCEL_PATH）] [--watch]  /  --history <カード名・型番の一部>
+    argv = sys.argv[1:] if argv is None else argv
+    if "--history" in argv:
+        i = argv.index("--history")
+        show_history(argv[i + 1] if i + 1 < len(argv) else "")
+        return
+    args = [a for a in argv if a != "--watch"]
+    path = args[0] if args and args[0] else EXCEL_PATH
+    (watch if "--watch" in argv else build)(path)
+
+if __name__ == "__main__":
+    main()
 
@@ -0,0 +1,51 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import build_pokeka_static as b  # noqa: E402
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# 短いキーになる前のページ（CARDS_MODE=inline で name / code / price をそのまま埋めていた版）
+LEGACY = [
+    {"name": "ピカチュウex", "pack": "", "code": "SV8-033", "rarity": "RR", "booster": "超電ブレイカー", "price": 1200},
+    {"name": "ピカチュウex", "pack": "", "code": "SV8-033", "rarity": "RR", "booster": "超電ブレイカー", "price": 1100},
+    {"name": "リーリエの決心", "pack": "", "code": "SV9-123", "rarity": "SAR", "booster": "バトルパートナーズ", "price": None},
+    {"name": "ナンジャモ", "pack": "", "code": "SV2D-091", "rarity": "SAR", "booster": "クレイバースト", "price": 80000},
+]
+
+
+def legacy_page(out_dir: Path, cards: list) -> None:
+    d = out_dir / "default"
+    d.mkdir(parents=True)
+    d.joinpath("index.html").write_text(
+        "<html><head><meta name='cards-ver' content='0123abcd'></head><body>"
+        f"<script>window.__CARDS__={json.dumps(cards, ensure_ascii=False)};</script></body></html>",
+        encoding="utf-8")
+
+
+def test_legacy_long_key_page_diffs_cleanly(tmp_path, monkeypatch):
+    monkeypatch.setattr(b, "OUT_DIR", tmp_path)
+    legacy_page(tmp_path, LEGACY)
+    ver, chg, prev = b.previous_build()
+    assert (ver, chg) == ("0123abcd", "")
+    assert prev == [(r["name"], r["code"], r["price"]) for r in LEGACY]
+
+    # 同じカードを今の行形式（短いキー）で出し直しても、増えた・消えたカードは出ない
+    cur = b.payload_rows([{"n": r["name"], "c": r["code"], "pr": r["price"]} for r in LEGACY])
+    d = b.diff_rows(prev, cur)
+    assert d == {"added": [], "up": [], "down": [], "priced": [], "removed": []}
+
+
+def test_published_page_rows_have_names():
+    page = ROOT / "docs" / "default" / "index.html"
+    html = page.read_text(encoding="utf-8")
+    head = "<script>window.__CARDS__="
+    i = html.find(head)
+    if i < 0:
+        pytest.skip("docs のページにペイロードが埋め込まれていない（CARDS_MODE=inline 以外でビルド済み）")
+    rows = b.payload_rows(json.JSONDecoder().raw_decode(html, i + len(head))[0])
+    assert rows and all(name for name, _, _ in rows)
@@ -0,0 +1,23 @@
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import build_pokeka_static as b  # noqa: E402
+
+# 半角カナ＋濁点・半濁点、全角英数、長音、SEP_RE に当たる区切り記号など
+TRICKY = [
+    "ｶﾞｷﾞｸﾞｹﾞｺﾞ ﾊﾟﾋﾟﾌﾟﾍﾟﾎﾟ ｳﾞ", "ﾎﾟｹﾓﾝｶｰﾄﾞ", "ｰ", "ラーメン ー ｰ －",
+    "ＡＢＣ１２３ ａｂｃ", "ＳＡＲ／ＭＵＲ", "OP01-001", "289/SV-P", "250／193",
+    "a b\tc　d", "モンキー・D・ルフィ", "A·B", "x_y—z–w−v", "",
+    "ゔ ヴ ヵヶ ヷ", "①②③ ⅠⅡⅢ", "ﾃﾞｯｷ ｹｰｽ", "Pikachu ex", "promo PROMO ﾌﾟﾛﾓ",
+]
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="node が無いので JS 側の正規化を実行できない")
+def test_search_key_normalizers_match_js():
+    vals = sorted(set(b.PARITY_SAMPLES) | set(TRICKY))
+    bad = b.search_key_parity_mismatches(b.base_js, vals)
+    assert bad == []